@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Benchmark of the redaction and hashing primitives
+Generates synthetic records shaped like user_data.csv and measures
+filter_datum, RedactingFormatter.format, redact_records, hash_password
+and is_valid. Each benchmark reports ops/sec, latency percentiles and
+peak traced memory; --json writes the results in machine-readable form.
+"""
+import argparse
+import json
+import logging
+import random
+import string
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Sequence
+from encrypt_password import hash_password, is_valid
+from filtered_logger import (PII_FIELDS, RedactingFormatter, filter_datum,
+                             redact_records)
+
+
+BASE_FIELDS = ("name", "email", "phone", "ssn", "password", "ip",
+               "last_login", "user_agent")
+
+
+def _word(rng: random.Random, size: int) -> str:
+    """Return a random alphanumeric string"""
+    return "".join(rng.choices(string.ascii_letters + string.digits,
+                               k=size))
+
+
+def generate_records(count: int, field_count: int = len(BASE_FIELDS),
+                     seed: int = 0) -> List[Dict[str, str]]:
+    """Generate `count` records with the columns of user_data.csv,
+    padded with extra_<n> columns up to `field_count` fields
+    """
+    rng = random.Random(seed)
+    fields = list(BASE_FIELDS[:field_count]) + [
+        "extra_{}".format(i) for i in range(field_count - len(BASE_FIELDS))]
+    records = []
+    for _ in range(count):
+        values = {
+            "name": "{} {}".format(_word(rng, 6), _word(rng, 8)),
+            "email": "{}@{}.com".format(_word(rng, 8), _word(rng, 5)),
+            "phone": "({}) {}-{}".format(rng.randint(100, 999),
+                                         rng.randint(100, 999),
+                                         rng.randint(1000, 9999)),
+            "ssn": "{}-{}-{}".format(rng.randint(100, 999),
+                                     rng.randint(10, 99),
+                                     rng.randint(1000, 9999)),
+            "password": _word(rng, 8),
+            "ip": ":".join(_word(rng, 4) for _ in range(8)),
+            "last_login": "2019-11-14 06:{:02d}:{:02d}".format(
+                rng.randint(0, 59), rng.randint(0, 59)),
+            "user_agent": "Mozilla/5.0 ({})".format(_word(rng, 60)),
+        }
+        records.append({field: values.get(field, _word(rng, 12))
+                        for field in fields})
+    return records
+
+
+def _percentile(sorted_ns: Sequence[int], pct: float) -> float:
+    """Return a percentile of sorted latencies, in microseconds"""
+    index = min(int(len(sorted_ns) * pct / 100), len(sorted_ns) - 1)
+    return sorted_ns[index] / 1000
+
+
+def measure(name: str, fn: Callable, args: Sequence[tuple]) -> Dict:
+    """Call fn once per argument tuple and summarize the run"""
+    if not args:
+        raise ValueError("{}: nothing to measure".format(name))
+    latencies = []
+    start = time.perf_counter_ns()
+    for call_args in args:
+        t0 = time.perf_counter_ns()
+        fn(*call_args)
+        latencies.append(time.perf_counter_ns() - t0)
+    total_ns = time.perf_counter_ns() - start
+    tracemalloc.start()
+    for call_args in args:
+        fn(*call_args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    latencies.sort()
+    return {
+        "name": name,
+        "ops": len(args),
+        "ops_per_sec": len(args) / (total_ns / 1e9) if total_ns else 0,
+        "p50_us": _percentile(latencies, 50),
+        "p95_us": _percentile(latencies, 95),
+        "p99_us": _percentile(latencies, 99),
+        "max_us": latencies[-1] / 1000,
+        "peak_memory_bytes": peak,
+    }
+
+
+def run(records: int, field_count: int, hashes: int,
+        rounds: int) -> List[Dict]:
+    """Run every benchmark and return the results"""
+    data = generate_records(records, field_count)
+    messages = [";".join("{}={}".format(k, v) for k, v in record.items())
+                + ";" for record in data]
+    formatter = RedactingFormatter(PII_FIELDS)  # type: ignore
+
+    def format_message(msg: str) -> str:
+        record = logging.LogRecord("user_data", logging.INFO, "", 0, msg,
+                                   None, None)
+        return formatter.format(record)
+
+    passwords = [record.get("password", "secret") for record in data]
+    passwords = (passwords * (hashes // max(len(passwords), 1) + 1))[:hashes]
+    hashed = [hash_password(password, rounds) for password in passwords]
+    results = [
+        measure("filter_datum", filter_datum,
+                [(PII_FIELDS, "***", msg, ";") for msg in messages]),
+        measure("RedactingFormatter.format", format_message,
+                [(msg,) for msg in messages]),
+        measure("redact_records", lambda r: list(redact_records([r])),
+                [(record,) for record in data]),
+    ]
+    if hashes > 0:
+        results += [
+            measure("hash_password", hash_password,
+                    [(password, rounds) for password in passwords]),
+            measure("is_valid", is_valid, list(zip(hashed, passwords))),
+        ]
+    return results
+
+
+def main() -> None:
+    """Parse command line arguments and print the benchmark results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--records", type=int, default=10000,
+                        help="number of synthetic records")
+    parser.add_argument("-f", "--fields", type=int, default=len(BASE_FIELDS),
+                        help="number of fields per record")
+    parser.add_argument("--hashes", type=int, default=20,
+                        help="number of bcrypt hashes and checks")
+    parser.add_argument("--rounds", type=int, default=12,
+                        help="bcrypt cost factor")
+    parser.add_argument("--json", metavar="PATH",
+                        help="write results as JSON ('-' for stdout)")
+    args = parser.parse_args()
+    results = run(args.records, args.fields, args.hashes, args.rounds)
+    report = {
+        "python": sys.version.split()[0],
+        "records": args.records,
+        "fields": args.fields,
+        "rounds": args.rounds,
+        "results": results,
+    }
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    print("{:<28}{:>12}{:>10}{:>10}{:>10}{:>12}".format(
+        "benchmark", "ops/sec", "p50 us", "p95 us", "p99 us", "peak KiB"))
+    for result in results:
+        print("{:<28}{:>12.0f}{:>10.1f}{:>10.1f}{:>10.1f}{:>12.1f}".format(
+            result["name"], result["ops_per_sec"], result["p50_us"],
+            result["p95_us"], result["p99_us"],
+            result["peak_memory_bytes"] / 1024))
+
+
+if __name__ == "__main__":
+    main()
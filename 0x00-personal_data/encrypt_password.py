@@ -3,19 +3,87 @@
 A hash_password function that expects one string argument name `password`
 and returns a salted, hashed password, which is a byte string.
 It uses the `bcrypt` library to hash the password.
+Batch helpers spread the hashing over a pool of processes.
+The bcrypt cost can be calibrated to a latency budget on the current
+machine, and stored hashes with a different cost can be rehashed.
 """
+import atexit
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from typing import Callable, Deque, Iterable, Iterator, List, Optional, Tuple
 import bcrypt
 
 
-def hash_password(password: str) -> bytes:
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+
+_target_rounds: Optional[int] = None
+
+
+def calibrate_rounds(target_ms: float,
+                     min_rounds: int = MIN_ROUNDS,
+                     max_rounds: int = MAX_ROUNDS) -> int:
+    """
+    Find the highest bcrypt cost whose hash time fits a latency budget.
+
+    Each extra round doubles the work, so the hash is timed once at
+    min_rounds and the cost is raised while the projection stays within
+    the budget.
+
+    :param target_ms: Latency budget for one hash, in milliseconds.
+    :return: A cost factor between min_rounds and max_rounds.
+    """
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(min_rounds))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = min_rounds
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        elapsed_ms *= 2
+        rounds += 1
+    return rounds
+
+
+def target_rounds() -> int:
+    """
+    Return the bcrypt cost used for new hashes.
+
+    When BCRYPT_TARGET_MS is set, the cost is calibrated once per process
+    to fit that budget; otherwise bcrypt's default cost is used.
+    """
+    global _target_rounds
+    if _target_rounds is None:
+        target_ms = os.environ.get("BCRYPT_TARGET_MS")
+        if target_ms:
+            _target_rounds = calibrate_rounds(float(target_ms))
+        else:
+            _target_rounds = DEFAULT_ROUNDS
+    return _target_rounds
+
+
+def hash_rounds(hashed_password: bytes) -> int:
+    """
+    Read the cost factor stored in a bcrypt hash.
+
+    :param hashed_password: A hash such as b"$2b$12$...".
+    :return: The cost factor of the hash.
+    """
+    return int(hashed_password.split(b"$")[2])
+
+
+def hash_password(password: str, rounds: Optional[int] = None) -> bytes:
     """
     Hash a password using bcrypt.
 
     :param password: The password to hash.
+    :param rounds: The bcrypt cost, defaults to target_rounds().
     :return: A salted, hashed password as a byte string.
     """
     # Generate a salt
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds or target_rounds())
     # Hash the password with the generated salt
     hashed_password = bcrypt.hashpw(password.encode('utf-8'), salt)
     return hashed_password
@@ -32,3 +100,112 @@ def is_valid(hashed_password: bytes, password: str) -> bool:
     if bcrypt.checkpw(password.encode(), hashed_password):
         return True
     return False
+
+
+def verify_and_check(hashed_password: bytes,
+                     password: str) -> Tuple[bool, bool]:
+    """
+    Check a password and report whether its hash should be upgraded.
+
+    :param hashed_password: The hashed password to check against.
+    :param password: The plain text password to verify.
+    :return: (valid, needs_rehash); needs_rehash is True when the password
+             matches but the stored cost differs from target_rounds(),
+             in which case the caller should store hash_password(password).
+    """
+    if not is_valid(hashed_password, password):
+        return False, False
+    return True, hash_rounds(hashed_password) != target_rounds()
+
+
+_executor: Optional[ProcessPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_executor() -> Executor:
+    """
+    Return the process pool shared by the batch and async helpers.
+
+    The pool size is read from BCRYPT_WORKERS and defaults to the number
+    of CPUs. It is shut down at interpreter exit.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            workers = int(os.environ.get("BCRYPT_WORKERS", 0)) or None
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            atexit.register(_executor.shutdown)
+    return _executor
+
+
+def _bounded_map(fn: Callable, items: Iterable[tuple],
+                 limit: int) -> Iterator:
+    """
+    Apply fn to each argument tuple on the shared pool, in order.
+
+    :param limit: Maximum number of calls in flight at once.
+    """
+    executor = get_executor()
+    pending: Deque[Future] = deque()
+    for args in items:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= limit:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _limit(concurrency: Optional[int]) -> int:
+    """Default the number of calls in flight to twice the CPU count."""
+    return concurrency or 2 * (os.cpu_count() or 1)
+
+
+def hash_passwords(passwords: Iterable[str],
+                   concurrency: Optional[int] = None) -> List[bytes]:
+    """
+    Hash many passwords in parallel.
+
+    :param passwords: The passwords to hash.
+    :param concurrency: Maximum number of hashes in flight at once.
+    :return: The hashed passwords, in the order of the input.
+    """
+    rounds = target_rounds()
+    return list(_bounded_map(hash_password,
+                             ((password, rounds) for password in passwords),
+                             _limit(concurrency)))
+
+
+def verify_many(pairs: Iterable[Tuple[bytes, str]],
+                concurrency: Optional[int] = None) -> List[bool]:
+    """
+    Check many (hashed_password, password) pairs in parallel.
+
+    :param pairs: Tuples of a hashed password and a plain text password.
+    :param concurrency: Maximum number of checks in flight at once.
+    :return: One boolean per pair, in the order of the input.
+    """
+    return list(_bounded_map(is_valid, pairs, _limit(concurrency)))
+
+
+def hash_password_async(password: str) -> Future:
+    """
+    Hash a password on the shared process pool.
+
+    :param password: The password to hash.
+    :return: A future resolving to the hashed password.
+    """
+    return get_executor().submit(hash_password, password, target_rounds())
+
+
+def is_valid_async(hashed_password: bytes, password: str) -> Future:
+    """
+    Check a password on the shared process pool.
+
+    The returned future can be awaited from asyncio code through
+    `asyncio.wrap_future`.
+
+    :param hashed_password: The hashed password to check against.
+    :param password: The plain text password to verify.
+    :return: A future resolving to True if the password matches.
+    """
+    return get_executor().submit(is_valid, hashed_password, password)
@@ -10,12 +10,28 @@ Args:
 import re
 import logging
 import csv
-from typing import Dict, List
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import atexit
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import lru_cache, partial
+from itertools import islice
+from logging.handlers import QueueHandler
+from queue import Empty, Full, LifoQueue, Queue
+from typing import (TYPE_CHECKING, Any, Callable, Deque, Dict, Iterable,
+                    Iterator, List, Optional, TextIO, Tuple, Union)
 from os import environ
-import mysql.connector  # type: ignore
+
+if TYPE_CHECKING:
+    from mysql.connector.connection import MySQLConnection  # type: ignore
 
 
 PII_FIELDS = ("name", "phone", "ssn", "email", "address")
+BATCH_SIZE = 1000
 
 
 def filter_datum(fields: List[str],
@@ -31,8 +47,25 @@ def filter_datum(fields: List[str],
     The function should a regex to repkace occurences of certain field values
     with the redaction value.
     """
-    regex = r"(?i)({})".format("|".join(fields))
-    return re.sub(regex, redaction, msg, flags=re.IGNORECASE)
+    return _redactor(tuple(fields), redaction, separator)(msg)
+
+
+@lru_cache(maxsize=128)
+def _redactor(fields: Tuple[str, ...],
+              redaction: str,
+              separator: str) -> Callable[[str], str]:
+    """Compile the pattern for a set of fields once and return a function
+    that redacts every `field=value<separator>` pair in a single pass.
+    Compiled redactors are cached, keyed by fields, redaction and separator.
+    """
+    sep = re.escape(separator)
+    pattern = re.compile(
+        r"(?:^|(?<=\s)|(?<={sep}))({fields})=.*?(?={sep}|$)".format(
+            fields="|".join(re.escape(field) for field in fields),
+            sep=sep),
+        flags=re.IGNORECASE | re.DOTALL)
+    replacement = r"\1=" + redaction.replace("\\", r"\\")
+    return partial(pattern.sub, replacement)
 
 
 def get_logger() -> logging.Logger:
@@ -49,12 +82,20 @@ def get_logger() -> logging.Logger:
     return logger
 
 
-def get_db() -> mysql.connector.connection.MySQLConnection:
-    """Get a database connection"""
+def connect_db() -> Union[sqlite3.Connection, "MySQLConnection"]:
+    """Open a new database connection
+    If PERSONAL_DATA_DB_PATH is set, a local SQLite database at that path
+    is used as a stand-in for the MySQL server, and mysql-connector is
+    not needed.
+    """
+    db_path = environ.get("PERSONAL_DATA_DB_PATH")
+    if db_path:
+        return sqlite3.connect(db_path, check_same_thread=False)
     username = environ.get("PERSONAL_DATA_DB_USERNAME", "root")
     password = environ.get("PERSONAL_DATA_DB_PASSWORD", "")
     host = environ.get("PERSONAL_DATA_DB_HOST", "localhost")
     database = environ.get("PERSONAL_DATA_DB_NAME", "personal_data")
+    import mysql.connector  # type: ignore
     return mysql.connector.connect(
         user=username,
         password=password,
@@ -63,15 +104,156 @@ def get_db() -> mysql.connector.connection.MySQLConnection:
     )
 
 
+class PooledConnection:
+    """Connection checked out of a ConnectionPool
+    Every attribute is delegated to the underlying connection, except
+    close(), which hands the connection back to its pool.
+    """
+
+    def __init__(self, pool: "ConnectionPool", connection: Any):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._connection, name)
+
+    def close(self) -> None:
+        """Return the connection to the pool"""
+        if self._connection is not None:
+            self._pool.release(self._connection)
+            self._connection = None
+
+    def discard(self) -> None:
+        """Close the connection instead of returning it to the pool,
+        freeing its slot for a new one
+        """
+        if self._connection is not None:
+            self._pool.release(self._connection, broken=True)
+            self._connection = None
+
+
+class ConnectionPool:
+    """Bounded pool of reusable database connections
+    `connect` is any callable returning a DB-API connection. At most
+    `size` connections are checked out at once; acquire() blocks until
+    one is released. Idle connections are health-checked with
+    `SELECT 1` before being reused and replaced if the check fails.
+    """
+
+    def __init__(self, connect: Callable[[], Any], size: int = 5):
+        self._connect = connect
+        self._idle: LifoQueue = LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self.size = size
+
+    def acquire(self, timeout: Optional[float] = None) -> PooledConnection:
+        """Check a healthy connection out of the pool"""
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError("no database connection available")
+        try:
+            while True:
+                try:
+                    connection = self._idle.get_nowait()
+                except Empty:
+                    connection = self._connect()
+                    break
+                if self._is_healthy(connection):
+                    break
+                self._discard(connection)
+        except BaseException:
+            self._slots.release()
+            raise
+        return PooledConnection(self, connection)
+
+    def release(self, connection: Any, broken: bool = False) -> None:
+        """Put a connection back into the pool, or close it if it is
+        broken or still has an unread result set
+        """
+        try:
+            if broken or getattr(connection, "unread_result", False):
+                self._discard(connection)
+            else:
+                self._idle.put(connection)
+        finally:
+            self._slots.release()
+
+    def close_all(self) -> None:
+        """Close every idle connection"""
+        while True:
+            try:
+                self._discard(self._idle.get_nowait())
+            except Empty:
+                return
+
+    @staticmethod
+    def _is_healthy(connection: Any) -> bool:
+        """Check that a connection still answers queries"""
+        try:
+            cursor = connection.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception:
+            return False
+
+    @staticmethod
+    def _discard(connection: Any) -> None:
+        """Close a connection, ignoring errors from dead connections"""
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+
+_pool: Optional[ConnectionPool] = None
+_pool_lock = threading.Lock()
+
+
+def get_db() -> PooledConnection:
+    """Get a database connection from the shared pool
+    The pool holds PERSONAL_DATA_DB_POOL_SIZE connections (default 5);
+    closing the returned connection gives it back to the pool.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            size = int(environ.get("PERSONAL_DATA_DB_POOL_SIZE", 5))
+            _pool = ConnectionPool(connect_db, size)
+            atexit.register(_pool.close_all)
+    return _pool.acquire()
+
+
 def get_data() -> List[Dict[str, str]]:
     """Get data from the database"""
+    return list(stream_data())
+
+
+def stream_data(batch_size: int = BATCH_SIZE) -> Iterator[Dict[str, str]]:
+    """Yield rows of personal_data one at a time, fetching them from the
+    server in batches of `batch_size` so memory stays bounded regardless
+    of the size of the table.
+    """
     db = get_db()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM personal_data")
-    data = cursor.fetchall()
-    cursor.close()
-    db.close()
-    return data
+    try:
+        cursor = db.cursor()
+        try:
+            cursor.execute("SELECT * FROM personal_data")
+            columns = [column[0] for column in cursor.description]
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            try:
+                cursor.close()
+            except Exception:
+                # An abandoned stream leaves unread rows behind
+                db.discard()
+    finally:
+        db.close()
 
 
 class RedactingFormatter(logging.Formatter):
@@ -85,39 +267,258 @@ class RedactingFormatter(logging.Formatter):
     def __init__(self, fields: List[str]):
         super(RedactingFormatter, self).__init__(self.FORMAT)
         self.fields = fields
+        self._redact = _redactor(tuple(fields), self.REDACTION,
+                                 self.SEPARATOR)
 
     def format(self, record: logging.LogRecord) -> str:
         """
-        Method to filter values in incoming log records using filter_datum.
+        Method to filter values in incoming log records using the
+        redactor compiled once for this formatter.
         Values for fields in fields should be filtered.
         """
-        record.msg = filter_datum(
-            self.fields,
-            self.REDACTION,
-            record.msg,
-            self.SEPARATOR
-        )
+        record.msg = self._redact(record.getMessage())
+        record.args = None
         return super(RedactingFormatter, self).format(record)
 
 
+OVERFLOW_POLICIES = ("block", "drop", "sample")
+
+
+class RedactingQueueHandler(QueueHandler):
+    """Queue handler that hands records to a bounded queue without
+    formatting them, so the logging thread never pays for redaction or
+    I/O. When the queue is full, `overflow` decides what happens:
+    "block" waits for room, "drop" discards the record and "sample"
+    keeps one record out of every `sample_rate`, in place of the oldest
+    queued one, and drops the rest. Only "block" ever waits.
+    """
+
+    def __init__(self, queue: Queue, overflow: str = "block",
+                 sample_rate: int = 10):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("overflow must be one of {}".format(
+                ", ".join(OVERFLOW_POLICIES)))
+        super(RedactingQueueHandler, self).__init__(queue)
+        self.overflow = overflow
+        self.sample_rate = max(1, sample_rate)
+        self.dropped = 0
+        self._overflowed = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Leave formatting to the listener thread"""
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        """Put a record on the queue according to the overflow policy"""
+        if self.overflow == "block":
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+            return
+        except Full:
+            self._overflowed += 1
+        if self.overflow == "sample" \
+                and self._overflowed % self.sample_rate == 0:
+            record = self._evict_oldest(record)
+        if record is not None:
+            self.dropped += 1
+
+    def _evict_oldest(self, record: logging.LogRecord) -> Any:
+        """Make room for a record by dropping the oldest queued one,
+        without waiting. Returns the record that was dropped, or None.
+        """
+        try:
+            oldest = self.queue.get_nowait()
+        except Empty:
+            # Drained meanwhile: there is room again
+            try:
+                self.queue.put_nowait(record)
+            except Full:
+                return record
+            return None
+        if oldest is RedactingQueueListener._SENTINEL:
+            # The listener is stopping: keep its sentinel queued
+            record, oldest = oldest, record
+        try:
+            self.queue.put_nowait(record)
+        except Full:
+            return record
+        return oldest
+
+
+class RedactingQueueListener:
+    """Background thread that drains a RedactingQueueHandler queue,
+    redacts records with RedactingFormatter and writes them to `stream`
+    in batches of up to `batch_size` lines with a single flush each.
+    """
+
+    _SENTINEL = object()
+
+    def __init__(self, queue: Queue, stream: TextIO = None,
+                 fields: List[str] = PII_FIELDS,  # type: ignore
+                 batch_size: int = 100, stop_timeout: float = 5.0):
+        self.queue = queue
+        self.stream = stream if stream is not None else sys.stderr
+        self.formatter = RedactingFormatter(fields)
+        self.batch_size = batch_size
+        self.stop_timeout = stop_timeout
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start the writer thread"""
+        self._thread = threading.Thread(target=self._monitor, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Flush every queued record and stop the writer thread,
+        waiting at most `stop_timeout` seconds for each step
+        """
+        if self._thread is None:
+            return
+        if self._thread.is_alive():
+            try:
+                self.queue.put(self._SENTINEL, timeout=self.stop_timeout)
+            except Full:
+                pass
+            self._thread.join(self.stop_timeout)
+        self._thread = None
+
+    def handleError(self, record: Optional[logging.LogRecord]) -> None:
+        """Report a record that could not be formatted or written, like
+        logging.Handler.handleError, and keep the writer thread running
+        """
+        if not logging.raiseExceptions:
+            return
+        try:
+            sys.stderr.write("--- Logging error ---\n")
+            traceback.print_exc(file=sys.stderr)
+            if record is not None:
+                sys.stderr.write("Message: {!r}\nArguments: {!r}\n".format(
+                    record.msg, record.args))
+        except Exception:
+            pass
+
+    def _monitor(self) -> None:
+        """Write queued records until the sentinel is received"""
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            lines = []
+            for record in batch:
+                if record is self._SENTINEL:
+                    continue
+                try:
+                    lines.append(self.formatter.format(record))
+                except Exception:
+                    self.handleError(record)
+            if lines:
+                try:
+                    self.stream.write("\n".join(lines) + "\n")
+                    self.stream.flush()
+                except Exception:
+                    self.handleError(None)
+            if self._SENTINEL in batch:
+                return
+
+
+def get_async_logger(queue_size: int = 10000,
+                     batch_size: int = 100,
+                     overflow: str = "block",
+                     stream: TextIO = None) -> logging.Logger:
+    """Get the user_data logger backed by a bounded queue.
+    Records are redacted and written by a RedactingQueueListener thread,
+    which is stopped, and its queue flushed, at interpreter exit.
+    """
+    log_queue: Queue = Queue(maxsize=queue_size)
+    logger = logging.getLogger("user_data")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    logger.addHandler(RedactingQueueHandler(log_queue, overflow))
+    listener = RedactingQueueListener(log_queue, stream,
+                                      batch_size=batch_size)
+    listener.start()
+    atexit.register(listener.stop)
+    return logger
+
+
+def redact_records(records: Iterable[Dict[str, str]],
+                   fields: Iterable[str] = PII_FIELDS,
+                   redaction: str = RedactingFormatter.REDACTION,
+                   separator: str = "; ") -> Iterator[str]:
+    """Yield one redacted `key=value` line per record dict.
+    Values of keys listed in fields (case-insensitive) are replaced
+    directly, so no regex scan of the joined line is needed.
+    """
+    fields = frozenset(field.lower() for field in fields)
+    for record in records:
+        yield separator.join(
+            "{}={}".format(key, redaction if key.lower() in fields else value)
+            for key, value in record.items())
+
+
+def _redact_chunk(chunk: List[Dict[str, str]]) -> List[str]:
+    """Redact a chunk of rows inside a worker process"""
+    return list(redact_records(chunk))
+
+
+def _chunks(rows: Iterable[Dict[str, str]],
+            size: int) -> Iterator[List[Dict[str, str]]]:
+    """Split an iterable of rows into lists of at most `size` rows"""
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def run_pipeline(rows: Iterable[Dict[str, str]],
+                 logger: logging.Logger,
+                 workers: int,
+                 chunk_size: int = BATCH_SIZE) -> Tuple[int, float]:
+    """Fan rows out to a process pool in chunks for string building and
+    redaction, then log the results in their original order from the
+    calling process. At most two chunks per worker are in flight at once.
+    Returns the number of rows processed and the elapsed time in seconds.
+    """
+    count = 0
+    start = time.perf_counter()
+    pending: Deque[Future] = deque()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk in _chunks(rows, chunk_size):
+            pending.append(executor.submit(_redact_chunk, chunk))
+            if len(pending) >= workers * 2:
+                count += _write_lines(logger, pending.popleft().result())
+        while pending:
+            count += _write_lines(logger, pending.popleft().result())
+    return count, time.perf_counter() - start
+
+
+def _write_lines(logger: logging.Logger, lines: List[str]) -> int:
+    """Log already redacted lines and return how many were written"""
+    for line in lines:
+        logger.info(line)
+    return len(lines)
+
+
 def main():
     """Main function to set up logging and process data"""
     logger = get_logger()
-    data = get_data()
-    formatter = RedactingFormatter(PII_FIELDS)  # type: ignore
-    for record in data:
-        msg = "; ".join(f"{key}={value}" for key, value in record.items())
-        log_record = logging.LogRecord(
-            name=logger.name,
-            level=logging.INFO,
-            pathname="",
-            lineno=0,
-            msg=msg,
-            args=None,
-            exc_info=None
-        )
-        formatter.format(log_record)
-        logger.info(log_record.msg)
+    batch_size = int(environ.get("PERSONAL_DATA_BATCH_SIZE", BATCH_SIZE))
+    workers = int(environ.get("PERSONAL_DATA_WORKERS", 1))
+    if workers > 1:
+        count, elapsed = run_pipeline(stream_data(batch_size), logger,
+                                      workers, batch_size)
+        logger.info("%d rows in %.2fs (%.0f rows/sec)",
+                    count, elapsed, count / elapsed if elapsed else 0)
+        return
+    for line in redact_records(stream_data(batch_size)):
+        logger.info(line)
 
 
 if __name__ == "__main__":
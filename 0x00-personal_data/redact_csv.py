@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+"""Command line tool that streams a user_data.csv-style dump, redacts the
+PII_FIELDS columns and writes redacted CSV or log lines.
+Rows are processed one at a time, so memory stays constant whatever the
+size of the dump. With --workers, the file is split into byte ranges
+that are redacted in parallel and concatenated in order.
+Records are assumed to hold no embedded newlines.
+"""
+import argparse
+import csv
+import os
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, TextIO, Tuple
+from filtered_logger import PII_FIELDS, redact_records
+
+
+REDACTION = "***"
+
+
+def _header(path: str) -> Tuple[List[str], int]:
+    """Return the column names of a dump and the byte offset of its
+    first record
+    """
+    with open(path, 'rb') as f:
+        line = f.readline()
+    return next(csv.reader([line.decode('utf-8')])), len(line)
+
+
+def _lines(path: str, start: int, end: int) -> Iterator[str]:
+    """Yield the lines that begin inside the byte range [start, end)"""
+    with open(path, 'rb') as f:
+        f.seek(max(start - 1, 0))
+        if start > 0:
+            # Skip to the first line beginning at or after start
+            f.readline()
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            yield line.decode('utf-8')
+
+
+def byte_ranges(path: str, workers: int) -> List[Tuple[int, int]]:
+    """Split the records of a dump into `workers` contiguous byte ranges"""
+    _, start = _header(path)
+    size = os.path.getsize(path)
+    step = max(-(-(size - start) // max(workers, 1)), 1)
+    return [(s, min(s + step, size)) for s in range(start, size, step)]
+
+
+def redact_rows(rows: Iterable[List[str]], header: List[str],
+                fields: Iterable[str] = PII_FIELDS) -> Iterator[List[str]]:
+    """Replace the values of the `fields` columns of each row"""
+    fields = frozenset(field.lower() for field in fields)
+    columns = [i for i, name in enumerate(header) if name.lower() in fields]
+    for row in rows:
+        for i in columns:
+            if i < len(row):
+                row[i] = REDACTION
+        yield row
+
+
+def redact_range(path: str, start: int, end: int, out: TextIO,
+                 fmt: str = "csv") -> int:
+    """Redact the records in a byte range of a dump into `out`.
+    Returns the number of records written.
+    """
+    header, _ = _header(path)
+    rows = csv.reader(_lines(path, start, end))
+    count = 0
+    if fmt == "csv":
+        writer = csv.writer(out, lineterminator="\n")
+        for row in redact_rows(rows, header):
+            writer.writerow(row)
+            count += 1
+    else:
+        records = (dict(zip(header, row)) for row in rows)
+        for line in redact_records(records):
+            out.write(line + "\n")
+            count += 1
+    return count
+
+
+def _redact_part(path: str, start: int, end: int, fmt: str,
+                 directory: str) -> str:
+    """Redact one byte range into a temporary file and return its path"""
+    fd, part = tempfile.mkstemp(prefix=".redact_", dir=directory)
+    with os.fdopen(fd, 'w', newline='') as out:
+        redact_range(path, start, end, out, fmt)
+    return part
+
+
+def redact_file(path: str, out: TextIO, fmt: str = "csv",
+                workers: int = 1, directory: str = None) -> None:
+    """Redact a whole dump into `out`, optionally across processes"""
+    header, start = _header(path)
+    if fmt == "csv":
+        csv.writer(out, lineterminator="\n").writerow(header)
+    if workers <= 1:
+        redact_range(path, start, os.path.getsize(path), out, fmt)
+        return
+    directory = directory or tempfile.gettempdir()
+    ranges = byte_ranges(path, workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(_redact_part, path, s, e, fmt, directory)
+                   for s, e in ranges]
+        for future in futures:
+            part = future.result()
+            try:
+                with open(part, 'r', newline='') as f:
+                    shutil.copyfileobj(f, out)
+            finally:
+                os.remove(part)
+
+
+def main() -> None:
+    """Parse command line arguments and redact the given dump"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("input", help="CSV dump to redact")
+    parser.add_argument("-o", "--output",
+                        help="output file (default: standard output)")
+    parser.add_argument("-f", "--format", choices=("csv", "log"),
+                        default="csv", help="output format")
+    parser.add_argument("-w", "--workers", type=int, default=1,
+                        help="number of processes splitting the input")
+    args = parser.parse_args()
+    if args.output is None:
+        redact_file(args.input, sys.stdout, args.format, args.workers)
+        return
+    directory = os.path.dirname(os.path.abspath(args.output))
+    with open(args.output, 'w', newline='') as out:
+        redact_file(args.input, out, args.format, args.workers, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -10,12 +10,60 @@ import uuid
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+
+
+class Index():
+    """ Secondary hash index mapping the values of one attribute
+    to the IDs of the objects holding them
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self.ids_by_value = {}
+        self.value_by_id = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index (or re-index) an object
+        """
+        self.remove(obj.id)
+        value = getattr(obj, self.attribute, None)
+        try:
+            self.ids_by_value.setdefault(value, set()).add(obj.id)
+        except TypeError:
+            return
+        self.value_by_id[obj.id] = value
+
+    def remove(self, obj_id: str):
+        """ Drop an object from the index
+        """
+        if obj_id not in self.value_by_id:
+            return
+        value = self.value_by_id.pop(obj_id)
+        ids = self.ids_by_value[value]
+        ids.discard(obj_id)
+        if len(ids) == 0:
+            del self.ids_by_value[value]
+
+    def lookup(self, value) -> set:
+        """ Return the IDs of objects holding value,
+        or None if value can't be indexed
+        """
+        try:
+            return self.ids_by_value.get(value, set())
+        except TypeError:
+            return None
 
 
 class Base():
     """ Base class
     """
 
+    # Attributes with a secondary index, used by search for equality
+    indexed_attributes = ()
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
@@ -64,6 +112,7 @@ class Base():
         s_class = cls.__name__
         file_path = ".db_{}.json".format(s_class)
         DATA[s_class] = {}
+        INDEXES.pop(s_class, None)
         if not path.exists(file_path):
             return
 
@@ -71,6 +120,7 @@ class Base():
             objs_json = json.load(f)
             for obj_id, obj_json in objs_json.items():
                 DATA[s_class][obj_id] = cls(**obj_json)
+        cls._indexes()
 
     @classmethod
     def save_to_file(cls):
@@ -91,6 +141,8 @@ class Base():
         s_class = self.__class__.__name__
         self.updated_at = datetime.utcnow()
         DATA[s_class][self.id] = self
+        for index in self.__class__._indexes().values():
+            index.add(self)
         self.__class__.save_to_file()
 
     def remove(self):
@@ -99,8 +151,24 @@ class Base():
         s_class = self.__class__.__name__
         if DATA[s_class].get(self.id) is not None:
             del DATA[s_class][self.id]
+            for index in self.__class__._indexes().values():
+                index.remove(self.id)
             self.__class__.save_to_file()
 
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Return the indexes of the class, by attribute
+        """
+        s_class = cls.__name__
+        if INDEXES.get(s_class) is None:
+            INDEXES[s_class] = {}
+            for attribute in cls.indexed_attributes:
+                INDEXES[s_class][attribute] = Index(attribute)
+            for obj in DATA.get(s_class, {}).values():
+                for index in INDEXES[s_class].values():
+                    index.add(obj)
+        return INDEXES[s_class]
+
     @classmethod
     def count(cls) -> int:
         """ Count all objects
@@ -126,6 +194,7 @@ class Base():
         """ Search all objects with matching attributes
         """
         s_class = cls.__name__
+
         def _search(obj):
             if len(attributes) == 0:
                 return True
@@ -133,5 +202,15 @@ class Base():
                 if (getattr(obj, k) != v):
                     return False
             return True
-        
-        return list(filter(_search, DATA[s_class].values()))
+
+        objs = DATA[s_class]
+        indexes = cls._indexes()
+        for k, v in attributes.items():
+            if k not in indexes:
+                continue
+            ids = indexes[k].lookup(v)
+            if ids is not None:
+                candidates = [objs[obj_id] for obj_id in ids
+                              if obj_id in objs]
+                return list(filter(_search, candidates))
+        return list(filter(_search, objs.values()))
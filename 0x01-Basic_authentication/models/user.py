@@ -9,6 +9,8 @@ class User(Base):
     """ User class
     """
 
+    indexed_attributes = ('email',)
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
@@ -1,24 +1,78 @@
 #!/usr/bin/env python3
 """Basic authentication"""
 from api.v1.auth.auth import Auth
+from collections import OrderedDict
+from os import getenv
+from typing import TypeVar
+import hashlib
+import hmac
+import secrets
+import threading
+import time
 
 
-class BasicAuth(Auth):
-    """Basic authentication class that inherits from Auth"""
+class CredentialCache:
+    """Bounded cache of verified Authorization headers.
+    Headers are keyed by their HMAC under a per-process secret, so no
+    credentials are kept, and map to the ID and password hash of the
+    user they authenticated. An entry is dropped once ttl seconds old,
+    or when its user is removed or changes password.
+    """
+
+    def __init__(self, size: int = 10000, ttl: float = 60.0):
+        """Initialize an empty cache"""
+        self.size = size
+        self.ttl = ttl
+        self.secret = secrets.token_bytes(32)
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _key(self, authorization_header: str) -> bytes:
+        """Return the keyed digest of a header"""
+        return hmac.new(self.secret, authorization_header.encode(),
+                        hashlib.sha256).digest()
+
+    def get(self, authorization_header: str) -> TypeVar('User'):
+        """Return the user a header authenticated, or None"""
+        from models.user import User
+        key = self._key(authorization_header)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            user_id, password, expires = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+        user = User.get(user_id)
+        if user is None or user.password != password:
+            with self.lock:
+                self.entries.pop(key, None)
+            return None
+        return user
+
+    def put(self, authorization_header: str, user: TypeVar('User')):
+        """Remember the user a header authenticated"""
+        if self.size <= 0:
+            return
+        key = self._key(authorization_header)
+        with self.lock:
+            self.entries[key] = (user.id, user.password,
+                                 time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
 
-    def __init__(self, username, password):
-        """Initialize with username and password"""
-        self.username = username
-        self.password = password
 
-    def authenticate(self, provided_username, provided_password):
-        """Check if provided credentials match the stored ones"""
-        return (provided_username == self.username and
-                provided_password == self.password)
+class BasicAuth(Auth):
+    """Basic authentication class that inherits from Auth"""
 
-    def __str__(self):
-        """Return a string representation of the authentication method"""
-        return f"BasicAuth(username={self.username})"
+    def __init__(self):
+        """Initialize the cache of verified credentials"""
+        self.cache = CredentialCache(
+            int(getenv("BASIC_AUTH_CACHE_SIZE", 10000)),
+            float(getenv("BASIC_AUTH_CACHE_TTL", 60)))
 
     def extract_base64_authorization_header(
             self, authorization_header: str) -> str:
@@ -86,7 +140,7 @@ class BasicAuth(Auth):
             self,
             user_email: str,
             user_pwd: str
-            ) -> TypeVar['User']:
+            ) -> TypeVar('User'):
         """Return a User object based on the provided credentials"""
         from models.user import User
         if not user_email or not user_pwd:
@@ -99,13 +153,18 @@ class BasicAuth(Auth):
                 return user
         return None
 
-    def current_user(self, request=None) -> str:
-        """Return the current user based on the request"""
+    def current_user(self, request=None) -> TypeVar('User'):
+        """Return the current user based on the request,
+        from the cache when the same header was verified before
+        """
         if request is None:
             return None
         auth_header = self.authorization_header(request)
         if not auth_header:
             return None
+        user = self.cache.get(auth_header)
+        if user is not None:
+            return user
         base64_auth_header = self.extract_base64_authorization_header(
             auth_header)
         if not base64_auth_header:
@@ -118,6 +177,7 @@ class BasicAuth(Auth):
             decoded_auth_header)
         if not username or not password:
             return None
-        if self.authenticate(username, password):
-            return username
-        return None
+        user = self.user_object_from_credentials(username, password)
+        if user is not None:
+            self.cache.put(auth_header, user)
+        return user
@@ -36,9 +36,14 @@ def forbidden() -> str:
 def stats() -> str:
     """ GET /api/v1/stats
     Return:
-      - the number of objects
+      - the number of users, the number of objects of each class,
+        the number of users created per day and per email domain
     """
+    from models.base import counts
     from models.user import User
     stats = {}
     stats['users'] = User.count()
+    stats['objects'] = counts()
+    stats['users_created_per_day'] = User.aggregate('created_per_day')
+    stats['users_per_email_domain'] = User.aggregate('per_email_domain')
     return jsonify(stats)
@@ -2,8 +2,44 @@
 """Module of Users views.
 """
 from api.v1.views import app_views
-from flask import abort, jsonify, request
+from flask import Response, abort, jsonify, request
 from models.user import User
+from os import getenv
+import hashlib
+
+
+USER_FILTERS = ('email', 'first_name', 'last_name')
+BATCH_MAX_ITEMS = 10000
+# Responses may be stored, but must be revalidated with their ETag
+CACHE_CONTROL = getenv("USERS_CACHE_CONTROL", "private, no-cache")
+
+
+def _user_etag(user: User) -> str:
+    """ Return the ETag of a user, derived from its last update.
+    Stored timestamps only keep seconds, so a digest of the (cached)
+    JSON tells apart updates made within the same second.
+    """
+    updated_at = user.updated_at.strftime("%Y%m%d%H%M%S") \
+        if user.updated_at is not None else ""
+    digest = hashlib.blake2b(user.to_json_bytes(), digest_size=8)
+    return "{}-{}-{}".format(user.id, updated_at, digest.hexdigest())
+
+
+def _not_modified(etag: str) -> Response:
+    """ Return a 304 response if the client already holds etag,
+    None otherwise
+    """
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return _cacheable(Response(status=304), etag)
+
+
+def _cacheable(response: Response, etag: str) -> Response:
+    """ Add the ETag and Cache-Control headers to a response
+    """
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    return response
 
 
 @app_views.route('/users', methods=['GET'], strict_slashes=False)
@@ -11,18 +47,58 @@ def view_all_users() -> str:
     """
     Retrieves a list of all User objects in JSON format.
 
-    Parameters:
-        user_id (str, optional): If set to 'me', returns the current authenticated user.
+    Query parameters:
+        email, first_name, last_name (optional): only return users whose
+            attribute equals the given value.
+        limit (int, optional): maximum number of users to return (at least 1).
+        cursor (str, optional): X-Next-Cursor value of the previous page.
+        stream (optional): if set, the JSON array is written incrementally.
 
     Returns:
         JSON response:
-            - 401 if 'me' is requested without authentication
-            - 404 if no user_id is given
-            - JSON list of all users (if user_id is not 'me')
-            - JSON representation of current user (if user_id is 'me')
+            - JSON list of the matching users, with an X-Next-Cursor
+              header when more pages remain
+            - 304 if If-None-Match holds the ETag of the current
+              version of the users
+            - 400 if limit or cursor is invalid
     """
-    all_users = [user.to_json() for user in User.all()]
-    return jsonify(all_users)
+    filters = {key: request.args.get(key) for key in USER_FILTERS
+               if request.args.get(key) is not None}
+    try:
+        limit = request.args.get('limit')
+        limit = int(limit) if limit is not None else None
+        offset = int(request.args.get('cursor', 0))
+    except ValueError:
+        limit, offset = None, -1
+    if offset < 0 or (limit is not None and limit < 1):
+        return jsonify({'error': "Wrong limit or cursor"}), 400
+    # Any change to the users changes the version, whatever the page
+    etag = "users-{}".format(User.version())
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    # One extra user tells whether another page follows
+    page = User.query(filters, limit=None if limit is None else limit + 1,
+                      offset=offset)
+    more = limit is not None and len(page) > limit
+    page = page[:limit]
+    if request.args.get('stream') is not None:
+        response = Response(_stream_json(page), mimetype='application/json')
+    else:
+        response = jsonify([user.to_json() for user in page])
+    if more:
+        response.headers['X-Next-Cursor'] = str(offset + limit)
+    return _cacheable(response, etag)
+
+
+def _stream_json(users: list):
+    """ Yield the JSON array of users one element at a time
+    """
+    yield b'['
+    for i, user in enumerate(users):
+        yield user.to_json_bytes() if i == 0 \
+            else b',' + user.to_json_bytes()
+    yield b']'
 
 
 @app_views.route('/users/<user_id>', methods=['GET'], strict_slashes=False)
@@ -36,6 +112,7 @@ def view_one_user(user_id: str = None) -> str:
     Returns:
         JSON response:
             - 200: JSON representation of the user
+            - 304: if If-None-Match holds the ETag of the user
             - 404: if user does not exist
     """
     if user_id is None:
@@ -43,12 +120,16 @@ def view_one_user(user_id: str = None) -> str:
     if user_id == 'me':
         if request.current_user is None:
             abort(404)
-        else:
-            return jsonify(request.current_user.to_json())
-    user = User.get(user_id)
+        user = request.current_user
+    else:
+        user = User.get(user_id)
     if user is None:
         abort(404)
-    return jsonify(user.to_json())
+    etag = _user_etag(user)
+    not_modified = _not_modified(etag)
+    if not_modified is not None:
+        return not_modified
+    return _cacheable(jsonify(user.to_json()), etag)
 
 
 @app_views.route('/users/<user_id>', methods=['DELETE'], strict_slashes=False)
@@ -137,4 +218,135 @@ def update_user(user_id: str = None) -> str:
     if rj.get('last_name') is not None:
         user.last_name = rj.get('last_name')
     user.save()
-    return jsonify(user.to_json()), 200
\ No newline at end of file
+    return jsonify(user.to_json()), 200
+
+
+def _batch_items():
+    """ Return the JSON list of a batch request,
+    or an error response if it isn't one
+    """
+    try:
+        rj = request.get_json()
+    except Exception:
+        rj = None
+    if type(rj) is not list:
+        return None, (jsonify({'error': "Wrong format"}), 400)
+    if len(rj) > BATCH_MAX_ITEMS:
+        return None, (jsonify({'error': "Too many items, at most {}".format(
+            BATCH_MAX_ITEMS)}), 400)
+    return rj, None
+
+
+def _batch_users(items: list) -> list:
+    """ Return the stored user of each item ({"id": ...} or an ID),
+    or None
+    """
+    ids = [item.get('id') if type(item) is dict else item for item in items]
+    return [User.get(user_id) if type(user_id) is str else None
+            for user_id in ids]
+
+
+@app_views.route('/users/batch', methods=['POST'], strict_slashes=False)
+def create_users() -> str:
+    """POST /api/v1/users/batch
+    JSON body:
+      - list of users to create, each with email, password
+        and optionally first_name and last_name.
+    Return:
+      - list with, for each item in order, its status (201 or 400)
+        and the created User or an error message.
+        All the created Users are persisted at once.
+      - 400 if the body isn't a list or holds too many items.
+    """
+    items, error = _batch_items()
+    if error is not None:
+        return error
+    results, users = [], []
+    for rj in items:
+        error_msg = None
+        if type(rj) is not dict:
+            error_msg = "Wrong format"
+        elif rj.get("email", "") == "":
+            error_msg = "email missing"
+        elif rj.get("password", "") == "":
+            error_msg = "password missing"
+        if error_msg is not None:
+            results.append({'status': 400, 'error': error_msg})
+            continue
+        user = User()
+        user.email = rj.get("email")
+        user.password = rj.get("password")
+        user.first_name = rj.get("first_name")
+        user.last_name = rj.get("last_name")
+        users.append(user)
+        results.append({'status': 201, 'user': user})
+    try:
+        User.save_many(users)
+    except Exception as e:
+        return jsonify({'error': "Can't create Users: {}".format(e)}), 400
+    for result in results:
+        if 'user' in result:
+            result['user'] = result['user'].to_json()
+    return jsonify(results), 200
+
+
+@app_views.route('/users/batch', methods=['PATCH'], strict_slashes=False)
+def update_users() -> str:
+    """PATCH /api/v1/users/batch
+    JSON body:
+      - list of updates, each with the User id
+        and optionally first_name and last_name.
+    Return:
+      - list with, for each item in order, its status (200, 400 or 404)
+        and the updated User or an error message.
+        All the updated Users are persisted at once.
+      - 400 if the body isn't a list or holds too many items.
+    """
+    items, error = _batch_items()
+    if error is not None:
+        return error
+    results, users = [], []
+    for rj, user in zip(items, _batch_users(items)):
+        if type(rj) is not dict:
+            results.append({'status': 400, 'error': "Wrong format"})
+            continue
+        if user is None:
+            results.append({'status': 404, 'error': "Not found"})
+            continue
+        if rj.get('first_name') is not None:
+            user.first_name = rj.get('first_name')
+        if rj.get('last_name') is not None:
+            user.last_name = rj.get('last_name')
+        users.append(user)
+        results.append({'status': 200, 'user': user})
+    User.save_many(users)
+    for result in results:
+        if 'user' in result:
+            result['user'] = result['user'].to_json()
+    return jsonify(results), 200
+
+
+@app_views.route('/users/batch', methods=['DELETE'], strict_slashes=False)
+def delete_users() -> str:
+    """DELETE /api/v1/users/batch
+    JSON body:
+      - list of User IDs (or of objects with an id) to delete.
+    Return:
+      - list with, for each item in order, its status
+        (200 or 404) and the User ID.
+        All the deletions are persisted at once.
+      - 400 if the body isn't a list or holds too many items.
+    """
+    items, error = _batch_items()
+    if error is not None:
+        return error
+    users = _batch_users(items)
+    removed = iter(User.remove_many(user for user in users
+                                    if user is not None))
+    results = []
+    for user in users:
+        if user is not None and next(removed):
+            results.append({'status': 200, 'id': user.id})
+        else:
+            results.append({'status': 404, 'error': "Not found"})
+    return jsonify(results), 200
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+""" Memory benchmark of the User model
+Builds N users with the slots-based models.user.User and with an
+equivalent __dict__-based class, and reports the memory traced per object
+(attribute values included) and the size of the object itself.
+__slots__ only removes the per-instance __dict__: the object shrinks by
+about half, but the attribute values dominate, so the memory per user
+only drops by a few percent.
+"""
+import argparse
+import gc
+import json
+import sys
+import tracemalloc
+from datetime import datetime
+from typing import Callable
+from models.user import User
+
+
+class DictUser():
+    """ User laid out like before __slots__: attributes in __dict__
+    """
+
+    def __init__(self, i: int):
+        """ Initialize with the same attributes as User
+        """
+        self.id = "{:036d}".format(i)
+        self.created_at = datetime.utcnow()
+        self.updated_at = datetime.utcnow()
+        self.email = "user{}@example.com".format(i)
+        self._password = "{:064x}".format(i)
+        self.first_name = "First{}".format(i)
+        self.last_name = "Last{}".format(i)
+
+
+def slots_user(i: int):
+    """ Build a User with the same attribute values as DictUser
+    """
+    user = User(id="{:036d}".format(i))
+    user.email = "user{}@example.com".format(i)
+    user._password = "{:064x}".format(i)
+    user.first_name = "First{}".format(i)
+    user.last_name = "Last{}".format(i)
+    return user
+
+
+def measure(name: str, build: Callable, count: int) -> dict:
+    """ Build count objects and return the memory they hold
+    """
+    gc.collect()
+    tracemalloc.start()
+    objs = [build(i) for i in range(count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    shell = sys.getsizeof(objs[0]) if objs else 0
+    if objs and hasattr(objs[0], '__dict__'):
+        shell += sys.getsizeof(objs[0].__dict__)
+    del objs
+    return {
+        "name": name,
+        "objects": count,
+        "bytes": current,
+        "bytes_per_object": current / count if count else 0,
+        "peak_bytes": peak,
+        "object_bytes": shell,
+    }
+
+
+def main():
+    """ Parse command line arguments and print the results
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--users", type=int, default=1000000,
+                        help="number of users to build")
+    parser.add_argument("--json", action="store_true",
+                        help="print results as JSON")
+    args = parser.parse_args()
+    results = [measure("dict", DictUser, args.users),
+               measure("slots", slots_user, args.users)]
+    if args.json:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+        return
+    for result in results:
+        print("{:<8}{:>10} users{:>10.1f} MiB{:>8.0f} B/user"
+              "{:>6} B/object".format(
+                  result["name"], result["objects"],
+                  result["bytes"] / 2 ** 20, result["bytes_per_object"],
+                  result["object_bytes"]))
+    saved = 1 - results[1]["bytes"] / results[0]["bytes"]
+    shell = 1 - results[1]["object_bytes"] / results[0]["object_bytes"]
+    print("slots save {:.0%} per object, {:.0%} per user".format(
+        shell, saved))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,35 +1,721 @@
 #!/usr/bin/env python3
 """ Base module
 """
-from datetime import datetime
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from functools import lru_cache, wraps
+from itertools import chain, islice
 from typing import TypeVar, List, Iterable
-from os import path
+from os import getenv, path
+import atexit
+import heapq
 import json
+import logging
+import os
+import struct
+import threading
+import time
 import uuid
 
 
 TIMESTAMP_FORMAT = "%Y-%m-%dT%H:%M:%S"
 DATA = {}
+INDEXES = {}
+AGGREGATES = {}
+# Version of each class, seeded with the load time so that versions
+# keep growing across restarts
+VERSIONS = {}
+LOCKS = {}
+_locks_lock = threading.Lock()
+_indexes_lock = threading.Lock()
+JOURNAL_SIZES = {}
+# The journal is compacted into the snapshot once it holds more entries
+# than both this and the number of objects, keeping writes amortized O(1)
+JOURNAL_MIN_ENTRIES = 1000
+WRITE_BEHIND = None
+# Storage backend replacing the in-memory store and its files, chosen by
+# STORE_BACKEND ("file", the default, or "sqlite"); see the end of module
+STORAGE = None
+# Snapshot format written by save_to_file: "json" or "binary"
+SNAPSHOT_FORMAT = getenv("STORE_FORMAT", "json")
+LOAD_STATS = {}
+# With STORE_LAZY set, objects are materialized from their stored record
+# on first access; STORE_LAZY_CACHE bounds how many are kept around
+LAZY = bool(getenv("STORE_LAZY"))
+LAZY_CACHE_SIZE = int(getenv("STORE_LAZY_CACHE", 10000))
+TIMESTAMP_ATTRIBUTES = ('created_at', 'updated_at')
+
+BINARY_MAGIC = b"BDB1"
+EPOCH = datetime(1970, 1, 1)
+NO_TIMESTAMP = -2 ** 63
+_LENGTH = struct.Struct(">I")
+
+# Query operators, and the upper bound of the keys sharing a prefix
+OPERATORS = ('eq', 'in', 'prefix', 'gt', 'gte', 'lt', 'lte')
+PREFIX_END = "\U0010ffff"
+
+
+def dump_binary(records: Iterable[dict], f):
+    """ Write objects, given by their attribute dicts, as a binary
+    snapshot: magic, length-prefixed JSON header naming the timestamp
+    and other attributes, then one length-prefixed record per object
+    holding its timestamps as packed 64-bit seconds followed by a JSON
+    array of the other attribute values
+    """
+    records = list(records)
+    timestamps, fields = set(), set()
+    for attrs in records:
+        for key, value in attrs.items():
+            (timestamps if type(value) is datetime else fields).add(key)
+    fields -= timestamps
+    timestamps, fields = sorted(timestamps), sorted(fields)
+    packer = struct.Struct(">{}q".format(len(timestamps)))
+    header = json.dumps({'timestamps': timestamps,
+                         'fields': fields}).encode()
+    f.write(BINARY_MAGIC + _LENGTH.pack(len(header)) + header)
+    one_second = timedelta(seconds=1)
+    for attrs in records:
+        stamps = packer.pack(*(
+            (attrs[key] - EPOCH) // one_second
+            if type(attrs.get(key)) is datetime else NO_TIMESTAMP
+            for key in timestamps))
+        values = json.dumps([attrs.get(key) for key in fields]).encode()
+        f.write(_LENGTH.pack(len(stamps) + len(values)) + stamps + values)
+
+
+def load_binary(cls: type, data: bytes, lazy: bool = False) -> dict:
+    """ Hydrate the objects of a binary snapshot by ID, without calling
+    __init__ or parsing timestamp strings.
+    If lazy, return their attribute dicts instead of objects.
+    """
+    if data[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError("not a binary snapshot")
+    offset = len(BINARY_MAGIC)
+    size, = _LENGTH.unpack_from(data, offset)
+    offset += _LENGTH.size
+    header = json.loads(data[offset:offset + size])
+    offset += size
+    timestamps, fields = header['timestamps'], header['fields']
+    packer = struct.Struct(">{}q".format(len(timestamps)))
+    stamps, values = [], []
+    while offset < len(data):
+        size, = _LENGTH.unpack_from(data, offset)
+        offset += _LENGTH.size
+        stamps.append(packer.unpack_from(data, offset))
+        values.append(data[offset + packer.size:offset + size])
+        offset += size
+    # Decode every record's values with a single call into the C parser
+    values = json.loads(b"[" + b",".join(values) + b"]")
+    new = cls.__new__
+    objs = {}
+    for record_stamps, record_values in zip(stamps, values):
+        attrs = dict(zip(fields, record_values))
+        for key, seconds in zip(timestamps, record_stamps):
+            if seconds != NO_TIMESTAMP:
+                attrs[key] = EPOCH + timedelta(seconds=seconds)
+        if lazy:
+            objs[attrs['id']] = attrs
+            continue
+        obj = new(cls)
+        obj._restore(attrs)
+        objs[obj.id] = obj
+    return objs
+
+
+class RWLock():
+    """ Readers/writer lock: any number of readers or one writer,
+    with waiting writers served first. The writing thread may take
+    the lock again, for reading or writing, and readers may nest.
+    """
+
+    def __init__(self):
+        """ Initialize an unlocked lock
+        """
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = None
+        self._depth = 0
+        self._waiting = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        """ Hold the lock for reading
+        """
+        depth = getattr(self._local, 'reads', 0)
+        if depth or self._writer == threading.get_ident():
+            self._local.reads = depth + 1
+            try:
+                yield
+            finally:
+                self._local.reads = depth
+            return
+        with self._condition:
+            while self._writer is not None or self._waiting:
+                self._condition.wait()
+            self._readers += 1
+        self._local.reads = 1
+        try:
+            yield
+        finally:
+            self._local.reads = 0
+            with self._condition:
+                self._readers -= 1
+                if self._readers == 0:
+                    self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        """ Hold the lock for writing
+        """
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._depth += 1
+            else:
+                self._waiting += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting -= 1
+                self._writer = me
+                self._depth = 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._writer = None
+                    self._condition.notify_all()
+
+
+def class_lock(cls: type) -> RWLock:
+    """ Return the lock guarding the objects of a class
+    """
+    s_class = cls.__name__
+    lock = LOCKS.get(s_class)
+    if lock is None:
+        with _locks_lock:
+            lock = LOCKS.setdefault(s_class, RWLock())
+    return lock
+
+
+def _locked(mode: str):
+    """ Run a Base method, or classmethod, holding its class lock
+    for "read" or "write"
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self_or_cls, *args, **kwargs):
+            cls = self_or_cls if isinstance(self_or_cls, type) \
+                else type(self_or_cls)
+            with getattr(class_lock(cls), mode)():
+                return method(self_or_cls, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@lru_cache(maxsize=None)
+def slot_names(cls: type) -> tuple:
+    """ Names of the slots of a class, base classes first
+    """
+    return tuple(name for klass in reversed(cls.__mro__)
+                 for name in klass.__dict__.get('__slots__', ())
+                 if name not in ('__dict__', '__weakref__', '_json_cache'))
+
+
+def _timestamp(value):
+    """ Parse a timestamp given as a string
+    """
+    if type(value) is str:
+        return datetime.strptime(value, TIMESTAMP_FORMAT)
+    return value
+
+
+def _predicates(where: dict) -> List[tuple]:
+    """ Return the predicates of a query as
+    (attribute, operator, operand) tuples
+    """
+    predicates = []
+    for attribute, condition in where.items():
+        if type(condition) is not dict:
+            condition = {'eq': condition}
+        for op, operand in condition.items():
+            if op not in OPERATORS:
+                raise ValueError("Unknown operator {}".format(op))
+            if op == 'prefix':
+                # Kept as a string, timestamps match by their stored form
+                if type(operand) is not str:
+                    raise ValueError("Prefix of {} isn't a string".format(
+                        attribute))
+            elif op == 'in':
+                operand = list(operand)
+                if attribute in TIMESTAMP_ATTRIBUTES:
+                    operand = [_timestamp(v) for v in operand]
+            elif attribute in TIMESTAMP_ATTRIBUTES:
+                operand = _timestamp(operand)
+            predicates.append((attribute, op, operand))
+    return predicates
+
+
+def _test(value, op: str, operand) -> bool:
+    """ Check a value against one predicate
+    """
+    try:
+        if op == 'eq':
+            return value == operand
+        if op == 'in':
+            return value in operand
+        if value is None:
+            return False
+        if op == 'prefix':
+            # Timestamps match by their stored string, as in indexes
+            if type(value) is datetime:
+                value = value.strftime(TIMESTAMP_FORMAT)
+            return type(value) is str and value.startswith(operand)
+        if op == 'gt':
+            return value > operand
+        if op == 'gte':
+            return value >= operand
+        if op == 'lt':
+            return value < operand
+        return value <= operand
+    except TypeError:
+        return False
+
+
+def timestamp_day(value) -> str:
+    """ Return the day of a timestamp (datetime or stored string)
+    as YYYY-MM-DD, or None
+    """
+    if type(value) is datetime:
+        return value.strftime("%Y-%m-%d")
+    if type(value) is str:
+        return value[:10]
+    return None
+
+
+def counts() -> dict:
+    """ Return the number of objects of each class, by class name
+    """
+    if STORAGE is not None:
+        return STORAGE.counts()
+    return {s_class: len(store) for s_class, store in list(DATA.items())}
+
+
+def _object_value(obj: TypeVar('Base'), attribute: str):
+    """ Return an attribute of an object, None if unset
+    """
+    return getattr(obj, attribute, None)
+
+
+def _record_value(record: dict, attribute: str):
+    """ Return an attribute of a stored record, timestamps as datetimes
+    """
+    value = record.get(attribute)
+    if attribute in TIMESTAMP_ATTRIBUTES:
+        return _timestamp(value)
+    return value
+
+
+class Index():
+    """ Secondary hash index mapping the values of one attribute
+    to the IDs of the objects holding them.
+    Timestamps are keyed by their stored string, so stored records and
+    objects share keys. The distinct keys are also kept sorted for
+    prefix and range scans, once a first scan asked for them.
+    """
+
+    def __init__(self, attribute: str):
+        """ Initialize an empty index on attribute
+        """
+        self.attribute = attribute
+        self.ids_by_value = {}
+        self.value_by_id = {}
+        self.sorted_keys = None
+        self.sortable = True
+        self.sorted_lock = threading.Lock()
+
+    @staticmethod
+    def key(value):
+        """ Return the key of an attribute value
+        """
+        if type(value) is datetime:
+            return value.strftime(TIMESTAMP_FORMAT)
+        return value
+
+    def add(self, obj: TypeVar('Base')):
+        """ Index (or re-index) an object
+        """
+        self.set(obj.id, getattr(obj, self.attribute, None))
+
+    def set(self, obj_id: str, value):
+        """ Index (or re-index) the value held by an object ID
+        """
+        self.remove(obj_id)
+        key = self.key(value)
+        try:
+            ids = self.ids_by_value.get(key)
+        except TypeError:
+            return
+        if ids is None:
+            ids = self.ids_by_value[key] = set()
+            if self.sorted_keys is not None and key is not None:
+                try:
+                    self.sorted_keys.insert(
+                        bisect_left(self.sorted_keys, key), key)
+                except TypeError:
+                    self.sorted_keys, self.sortable = None, False
+        ids.add(obj_id)
+        self.value_by_id[obj_id] = key
+
+    def remove(self, obj_id: str):
+        """ Drop an object from the index
+        """
+        if obj_id not in self.value_by_id:
+            return
+        key = self.value_by_id.pop(obj_id)
+        ids = self.ids_by_value[key]
+        ids.discard(obj_id)
+        if len(ids) == 0:
+            del self.ids_by_value[key]
+            if self.sorted_keys is not None and key is not None:
+                del self.sorted_keys[bisect_left(self.sorted_keys, key)]
+
+    def lookup(self, value) -> set:
+        """ Return the IDs of objects holding value,
+        or None if value can't be indexed
+        """
+        try:
+            return self.ids_by_value.get(self.key(value), set())
+        except TypeError:
+            return None
+
+    def scan(self, low=None, high=None, prefix: str = None,
+             reverse: bool = False) -> Iterable[set]:
+        """ Return the ID sets of the keys between low and high
+        (inclusive) that start with prefix, in key order,
+        or None if the keys can't be ordered
+        """
+        with self.sorted_lock:
+            if self.sorted_keys is None and self.sortable:
+                try:
+                    self.sorted_keys = sorted(
+                        key for key in self.ids_by_value if key is not None)
+                except TypeError:
+                    self.sortable = False
+        keys = self.sorted_keys
+        if keys is None:
+            return None
+        try:
+            start = 0 if low is None else bisect_left(keys, low)
+            stop = len(keys) if high is None else bisect_right(keys, high)
+            if prefix is not None:
+                start = max(start, bisect_left(keys, prefix))
+                stop = min(stop, bisect_left(keys, prefix + PREFIX_END))
+        except TypeError:
+            return None
+        positions = range(start, stop)
+        if reverse:
+            positions = reversed(positions)
+        return (self.ids_by_value[keys[i]] for i in positions)
+
+
+class Aggregate():
+    """ Number of objects by a key computed from one attribute,
+    maintained like an Index as objects are saved and removed
+    """
+
+    def __init__(self, attribute: str, key):
+        """ Initialize empty counts of key(value of attribute)
+        """
+        self.attribute = attribute
+        self.key = key
+        self.counts = {}
+        self.key_by_id = {}
+
+    def add(self, obj: TypeVar('Base')):
+        """ Count (or recount) an object
+        """
+        self.set(obj.id, getattr(obj, self.attribute, None))
+
+    def set(self, obj_id: str, value):
+        """ Count (or recount) the value held by an object ID,
+        objects whose key is None aren't counted
+        """
+        self.remove(obj_id)
+        key = self.key(value)
+        if key is None:
+            return
+        self.counts[key] = self.counts.get(key, 0) + 1
+        self.key_by_id[obj_id] = key
+
+    def remove(self, obj_id: str):
+        """ Stop counting an object
+        """
+        key = self.key_by_id.pop(obj_id, None)
+        if key is None:
+            return
+        self.counts[key] -= 1
+        if self.counts[key] == 0:
+            del self.counts[key]
+
+
+class LazyStore():
+    """ Objects of one class kept as their stored records
+    (attribute dicts, with timestamps as strings or datetimes).
+    An object is only built when it is accessed, and the last
+    cache_size built objects are kept, most recently used last.
+    """
+
+    def __init__(self, cls: type, records: dict,
+                 cache_size: int = LAZY_CACHE_SIZE):
+        """ Initialize the store from records by ID
+        """
+        self.cls = cls
+        self.records = records
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        # Readers share the class lock, so the cache has its own
+        self.cache_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """ Number of objects
+        """
+        return len(self.records)
+
+    def __contains__(self, obj_id: str) -> bool:
+        """ Check if an object ID is stored
+        """
+        return obj_id in self.records
+
+    def __getitem__(self, obj_id: str) -> TypeVar('Base'):
+        """ Return one object, building it if needed
+        """
+        with self.cache_lock:
+            obj = self.cache.get(obj_id)
+            if obj is not None:
+                self.cache.move_to_end(obj_id)
+                return obj
+        obj = self.cls(**self.records[obj_id])
+        self._cache(obj_id, obj)
+        return obj
+
+    def _cache(self, obj_id: str, obj: TypeVar('Base')):
+        """ Keep a built object, evicting the least recently used
+        """
+        if self.cache_size <= 0:
+            return
+        with self.cache_lock:
+            self.cache[obj_id] = obj
+            self.cache.move_to_end(obj_id)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def __setitem__(self, obj_id: str, obj: TypeVar('Base')):
+        """ Store an object
+        """
+        self.records[obj_id] = obj.attributes()
+        self._cache(obj_id, obj)
+
+    def __delitem__(self, obj_id: str):
+        """ Remove an object
+        """
+        del self.records[obj_id]
+        with self.cache_lock:
+            self.cache.pop(obj_id, None)
+
+    def get(self, obj_id: str, default=None) -> TypeVar('Base'):
+        """ Return one object, or default if it isn't stored
+        """
+        if obj_id not in self.records:
+            return default
+        return self[obj_id]
+
+    def pop(self, obj_id: str, default=None):
+        """ Remove an object and return its record
+        """
+        with self.cache_lock:
+            self.cache.pop(obj_id, None)
+        return self.records.pop(obj_id, default)
+
+    def keys(self) -> Iterable[str]:
+        """ Stored object IDs
+        """
+        return self.records.keys()
+
+    def values(self) -> Iterable[TypeVar('Base')]:
+        """ Every object, built on the fly
+        """
+        for obj_id in list(self.records):
+            yield self.cache.get(obj_id) or \
+                self.cls(**self.records[obj_id])
+
+    def items(self) -> Iterable[tuple]:
+        """ Every (ID, object) pair, built on the fly
+        """
+        for obj in self.values():
+            yield obj.id, obj
+
+    def matches(self, obj_id: str, attributes: dict) -> bool:
+        """ Check attributes against an object's stored record
+        """
+        record = self.records.get(obj_id)
+        if record is None:
+            return False
+        for k, v in attributes.items():
+            value = record.get(k)
+            if type(v) is datetime and type(value) is str:
+                v = v.strftime(TIMESTAMP_FORMAT)
+            if value != v:
+                return False
+        return True
+
+    def attributes(self) -> Iterable[dict]:
+        """ Every stored record, with timestamps as datetimes
+        """
+        for record in list(self.records.values()):
+            record = dict(record)
+            for key in TIMESTAMP_ATTRIBUTES:
+                if type(record.get(key)) is str:
+                    record[key] = datetime.strptime(record[key],
+                                                    TIMESTAMP_FORMAT)
+            yield record
+
+    def json_records(self) -> dict:
+        """ Every stored record by ID, with timestamps as strings
+        """
+        result = {}
+        for obj_id, record in list(self.records.items()):
+            result[obj_id] = {
+                key: value.strftime(TIMESTAMP_FORMAT)
+                if type(value) is datetime else value
+                for key, value in record.items()}
+        return result
+
+
+class WriteBehind():
+    """ Group commit of the object store: classes changed by save() or
+    remove() are marked dirty and written to their snapshot file by a
+    background thread, every interval seconds or as soon as max_pending
+    changes are waiting, and once more on shutdown
+    """
+
+    def __init__(self, interval: float = 1.0, max_pending: int = 100):
+        """ Initialize and start the flushing thread
+        """
+        self.interval = interval
+        self.max_pending = max_pending
+        self.dirty = {}
+        self.pending = 0
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def mark(self, cls: type, changes: int = 1):
+        """ Mark a class as changed
+        """
+        with self.condition:
+            self.dirty[cls.__name__] = cls
+            self.pending += changes
+            if self.pending >= self.max_pending:
+                self.condition.notify()
+
+    def flush(self):
+        """ Write every dirty class to its snapshot file.
+        A class that fails to be written is logged and stays dirty,
+        to be retried on the next flush.
+        """
+        with self.condition:
+            dirty = self.dirty
+            self.dirty = {}
+            self.pending = 0
+        for s_class, cls in dirty.items():
+            try:
+                cls.save_to_file()
+            except Exception:
+                logging.getLogger(__name__).exception(
+                    "Write-behind flush of %s failed", s_class)
+                with self.condition:
+                    self.dirty.setdefault(s_class, cls)
+
+    def stop(self):
+        """ Stop the flushing thread and write pending changes
+        """
+        with self.condition:
+            self.stopped = True
+            self.condition.notify()
+        self.thread.join()
+        self.flush()
+
+    def _run(self):
+        """ Flush on the time or size threshold until stopped
+        """
+        while True:
+            with self.condition:
+                if self.pending < self.max_pending and not self.stopped:
+                    self.condition.wait(self.interval)
+                if self.stopped:
+                    return
+            self.flush()
+
+
+def enable_write_behind(interval: float = 1.0, max_pending: int = 100):
+    """ Switch the object store to write-behind mode
+    """
+    global WRITE_BEHIND
+    if WRITE_BEHIND is None:
+        WRITE_BEHIND = WriteBehind(interval, max_pending)
+        atexit.register(disable_write_behind)
+    return WRITE_BEHIND
+
+
+def disable_write_behind():
+    """ Flush pending changes and go back to synchronous writes
+    """
+    global WRITE_BEHIND
+    if WRITE_BEHIND is not None:
+        WRITE_BEHIND.stop()
+        WRITE_BEHIND = None
 
 
 class Base():
     """ Base class
+    Attributes live in __slots__, so instances carry no __dict__ unless
+    a subclass doesn't declare __slots__ itself. This only shrinks the
+    object itself: its attribute values (strings, datetimes) take most
+    of the memory of a User. Assigning an attribute that isn't a slot
+    raises AttributeError on such classes.
+    to_json results are cached until an attribute is assigned.
     """
 
+    __slots__ = ('id', 'created_at', 'updated_at', '_json_cache')
+
+    # Attributes with a secondary index, used by search for equality
+    indexed_attributes = ()
+    # Aggregate name: (attribute, function computing the counted key)
+    aggregates = {}
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a Base instance
         """
         s_class = str(self.__class__.__name__)
-        if DATA.get(s_class) is None:
-            DATA[s_class] = {}
+        DATA.setdefault(s_class, {})
 
         self.id = kwargs.get('id', str(uuid.uuid4()))
-        if kwargs.get('created_at') is not None:
+        if type(kwargs.get('created_at')) is datetime:
+            self.created_at = kwargs.get('created_at')
+        elif kwargs.get('created_at') is not None:
             self.created_at = datetime.strptime(kwargs.get('created_at'),
                                                 TIMESTAMP_FORMAT)
         else:
             self.created_at = datetime.utcnow()
-        if kwargs.get('updated_at') is not None:
+        if type(kwargs.get('updated_at')) is datetime:
+            self.updated_at = kwargs.get('updated_at')
+        elif kwargs.get('updated_at') is not None:
             self.updated_at = datetime.strptime(kwargs.get('updated_at'),
                                                 TIMESTAMP_FORMAT)
         else:
@@ -44,11 +730,60 @@ class Base():
             return False
         return (self.id == other.id)
 
+    def attributes(self) -> dict:
+        """ Return the set attributes of the object by name
+        """
+        result = {}
+        for name in slot_names(type(self)):
+            try:
+                result[name] = getattr(self, name)
+            except AttributeError:
+                continue
+        result.update(getattr(self, '__dict__', {}))
+        return result
+
+    def _restore(self, attrs: dict):
+        """ Set attributes from a dict, bypassing __init__
+        """
+        for name, value in attrs.items():
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name: str, value):
+        """ Set an attribute and drop the cached serializations
+        """
+        object.__setattr__(self, name, value)
+        object.__setattr__(self, '_json_cache', None)
+
+    def _cached_json(self) -> dict:
+        """ Return the serialization cache of the object
+        """
+        cache = getattr(self, '_json_cache', None)
+        if cache is None:
+            cache = {}
+            object.__setattr__(self, '_json_cache', cache)
+        return cache
+
     def to_json(self, for_serialization: bool = False) -> dict:
         """ Convert the object a JSON dictionary
         """
+        cache = self._cached_json()
+        if for_serialization not in cache:
+            cache[for_serialization] = self._to_json(for_serialization)
+        return dict(cache[for_serialization])
+
+    def to_json_bytes(self) -> bytes:
+        """ Return the encoded JSON of to_json()
+        """
+        cache = self._cached_json()
+        if 'bytes' not in cache:
+            cache['bytes'] = json.dumps(self.to_json()).encode()
+        return cache['bytes']
+
+    def _to_json(self, for_serialization: bool) -> dict:
+        """ Build the JSON dictionary of the object
+        """
         result = {}
-        for key, value in self.__dict__.items():
+        for key, value in self.attributes().items():
             if not for_serialization and key[0] == '_':
                 continue
             if type(value) is datetime:
@@ -58,74 +793,297 @@ class Base():
         return result
 
     @classmethod
+    @_locked("write")
     def load_from_file(cls):
-        """ Load all objects from file
+        """ Load all objects from the snapshot file,
+        then replay the journal of changes made since
         """
         s_class = cls.__name__
+        if STORAGE is not None:
+            STORAGE.load(cls)
+            return
         file_path = ".db_{}.json".format(s_class)
+        binary_path = ".db_{}.bin".format(s_class)
+        start = time.perf_counter()
         DATA[s_class] = {}
-        if not path.exists(file_path):
-            return
+        INDEXES.pop(s_class, None)
+        VERSIONS[s_class] = time.time_ns()
+        JOURNAL_SIZES[s_class] = 0
+        snapshot = None
+        if path.exists(binary_path):
+            snapshot = binary_path
+            with open(binary_path, 'rb') as f:
+                DATA[s_class] = load_binary(cls, f.read(), LAZY)
+        elif path.exists(file_path):
+            snapshot = file_path
+            with open(file_path, 'r') as f:
+                objs_json = json.load(f)
+                if LAZY:
+                    DATA[s_class] = objs_json
+                else:
+                    for obj_id, obj_json in objs_json.items():
+                        DATA[s_class][obj_id] = cls(**obj_json)
+        if LAZY:
+            DATA[s_class] = LazyStore(cls, DATA[s_class])
+        cls._replay_journal()
+        cls._indexes()
+        LOAD_STATS[s_class] = {
+            'snapshot': snapshot,
+            'objects': len(DATA[s_class]),
+            'seconds': time.perf_counter() - start,
+        }
+        logging.getLogger(__name__).info(
+            "Loaded %d %s objects from %s in %.3fs", len(DATA[s_class]),
+            s_class, snapshot, LOAD_STATS[s_class]['seconds'])
 
-        with open(file_path, 'r') as f:
-            objs_json = json.load(f)
-            for obj_id, obj_json in objs_json.items():
-                DATA[s_class][obj_id] = cls(**obj_json)
+    @classmethod
+    def _replay_journal(cls):
+        """ Apply the journal entries on top of the loaded snapshot
+        """
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        if not path.exists(journal_path):
+            return
+        torn = False
+        with open(journal_path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # Torn last write: the entry was never acknowledged
+                    torn = True
+                    break
+                if entry['op'] == 'upsert':
+                    DATA[s_class][entry['id']] = cls(**entry['obj'])
+                elif entry['op'] == 'delete':
+                    DATA[s_class].pop(entry['id'], None)
+                JOURNAL_SIZES[s_class] += 1
+        if torn:
+            # Compact so new entries aren't appended after the torn one
+            cls.save_to_file()
 
     @classmethod
+    @_locked("write")
     def save_to_file(cls):
-        """ Save all objects to file
+        """ Save all objects to the snapshot file and empty the journal
         """
         s_class = cls.__name__
+        if STORAGE is not None:
+            return
         file_path = ".db_{}.json".format(s_class)
-        objs_json = {}
-        for obj_id, obj in DATA[s_class].items():
-            objs_json[obj_id] = obj.to_json(True)
+        binary_path = ".db_{}.bin".format(s_class)
+        store = DATA[s_class]
+        if SNAPSHOT_FORMAT == "binary":
+            file_path, stale_path = binary_path, file_path
+            if isinstance(store, LazyStore):
+                records = store.attributes()
+            else:
+                records = [obj.attributes() for obj in list(store.values())]
+            tmp_path = "{}.tmp".format(file_path)
+            with open(tmp_path, 'wb') as f:
+                dump_binary(records, f)
+        else:
+            stale_path = binary_path
+            if isinstance(store, LazyStore):
+                objs_json = store.json_records()
+            else:
+                objs_json = {}
+                for obj_id, obj in list(store.items()):
+                    objs_json[obj_id] = obj.to_json(True)
+            tmp_path = "{}.tmp".format(file_path)
+            with open(tmp_path, 'w') as f:
+                json.dump(objs_json, f)
+        os.replace(tmp_path, file_path)
+        # Only one snapshot format may exist, load_from_file prefers binary
+        if path.exists(stale_path):
+            os.remove(stale_path)
+        journal_path = ".db_{}.journal".format(s_class)
+        if path.exists(journal_path):
+            os.remove(journal_path)
+        JOURNAL_SIZES[s_class] = 0
 
-        with open(file_path, 'w') as f:
-            json.dump(objs_json, f)
+    @classmethod
+    def _journal(cls, *entries: dict):
+        """ Append changes to the journal in a single write,
+        compacting it into the snapshot when it grows too long.
+        In write-behind mode the class is only marked dirty.
+        """
+        if len(entries) == 0:
+            return
+        if WRITE_BEHIND is not None:
+            WRITE_BEHIND.mark(cls, len(entries))
+            return
+        s_class = cls.__name__
+        journal_path = ".db_{}.journal".format(s_class)
+        with open(journal_path, 'a') as f:
+            f.write("".join(json.dumps(entry) + "\n" for entry in entries))
+        JOURNAL_SIZES[s_class] = JOURNAL_SIZES.get(s_class, 0) + len(entries)
+        if JOURNAL_SIZES[s_class] > max(JOURNAL_MIN_ENTRIES,
+                                        len(DATA[s_class])):
+            cls.save_to_file()
 
     def save(self):
         """ Save current object
         """
-        s_class = self.__class__.__name__
-        self.updated_at = datetime.utcnow()
-        DATA[s_class][self.id] = self
-        self.__class__.save_to_file()
+        self.__class__.save_many([self])
 
     def remove(self):
         """ Remove object
         """
-        s_class = self.__class__.__name__
-        if DATA[s_class].get(self.id) is not None:
-            del DATA[s_class][self.id]
-            self.__class__.save_to_file()
+        self.__class__.remove_many([self])
+
+    @classmethod
+    @_locked("write")
+    def save_many(cls, objs: Iterable[TypeVar('Base')]):
+        """ Save objects of the class, persisting them at once
+        """
+        s_class = cls.__name__
+        objs = list(objs)
+        now = datetime.utcnow()
+        for obj in objs:
+            obj.updated_at = now
+            object.__setattr__(obj, '_json_cache', None)
+        if STORAGE is not None:
+            STORAGE.save_many(cls, objs)
+            return
+        indexes = list(cls._indexes().values()) + \
+            list(cls._aggregates().values())
+        entries = []
+        for obj in objs:
+            DATA[s_class][obj.id] = obj
+            for index in indexes:
+                index.add(obj)
+            entries.append({'op': 'upsert', 'id': obj.id,
+                            'obj': obj.to_json(True)})
+        if entries:
+            VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+        cls._journal(*entries)
+
+    @classmethod
+    @_locked("write")
+    def remove_many(cls, objs: Iterable[TypeVar('Base')]) -> List[bool]:
+        """ Remove objects of the class, persisting it at once.
+        Returns, for each object, whether it was stored.
+        """
+        s_class = cls.__name__
+        objs = list(objs)
+        if STORAGE is not None:
+            return STORAGE.remove_many(cls, objs)
+        indexes = list(cls._indexes().values()) + \
+            list(cls._aggregates().values())
+        entries = []
+        removed = []
+        for obj in objs:
+            if DATA[s_class].get(obj.id) is None:
+                removed.append(False)
+                continue
+            del DATA[s_class][obj.id]
+            for index in indexes:
+                index.remove(obj.id)
+            entries.append({'op': 'delete', 'id': obj.id})
+            removed.append(True)
+        if entries:
+            VERSIONS[s_class] = VERSIONS.get(s_class, 0) + 1
+        cls._journal(*entries)
+        return removed
+
+    @classmethod
+    def _indexes(cls) -> dict:
+        """ Return the indexes of the class, by attribute,
+        building them and the aggregates if needed
+        """
+        s_class = cls.__name__
+        indexes = INDEXES.get(s_class)
+        if indexes is not None:
+            return indexes
+        with _indexes_lock:
+            if INDEXES.get(s_class) is not None:
+                return INDEXES[s_class]
+            indexes = {}
+            for attribute in cls.indexed_attributes:
+                indexes[attribute] = Index(attribute)
+            aggregates = {}
+            for name, (attribute, key) in cls.aggregates.items():
+                aggregates[name] = Aggregate(attribute, key)
+            maintained = list(indexes.values()) + list(aggregates.values())
+            store = DATA.get(s_class, {})
+            if isinstance(store, LazyStore):
+                # Index the stored records without building objects
+                for obj_id, record in store.records.items():
+                    for index in maintained:
+                        index.set(obj_id, record.get(index.attribute))
+            else:
+                for obj in store.values():
+                    for index in maintained:
+                        index.add(obj)
+            AGGREGATES[s_class] = aggregates
+            INDEXES[s_class] = indexes
+            return indexes
+
+    @classmethod
+    def _aggregates(cls) -> dict:
+        """ Return the aggregates of the class, by name
+        """
+        cls._indexes()
+        return AGGREGATES[cls.__name__]
 
     @classmethod
+    @_locked("read")
+    def aggregate(cls, name: str) -> dict:
+        """ Return the number of objects by key of an aggregate
+        declared in aggregates
+        """
+        if STORAGE is not None:
+            if name not in cls.aggregates:
+                raise KeyError(name)
+            return STORAGE.aggregate(cls, name)
+        return dict(cls._aggregates()[name].counts)
+
+    @classmethod
+    @_locked("read")
+    def version(cls) -> int:
+        """ Return the version of the objects of the class,
+        which grows whenever some are saved or removed
+        """
+        if STORAGE is not None:
+            return STORAGE.version(cls)
+        return VERSIONS.get(cls.__name__, 0)
+
+    @classmethod
+    @_locked("read")
     def count(cls) -> int:
         """ Count all objects
         """
         s_class = cls.__name__
+        if STORAGE is not None:
+            return STORAGE.count(cls)
         return len(DATA[s_class].keys())
 
     @classmethod
+    @_locked("read")
     def all(cls) -> Iterable[TypeVar('Base')]:
         """ Return all objects
         """
         return cls.search()
 
     @classmethod
+    @_locked("read")
     def get(cls, id: str) -> TypeVar('Base'):
         """ Return one object by ID
         """
         s_class = cls.__name__
+        if STORAGE is not None:
+            return STORAGE.get(cls, id)
         return DATA[s_class].get(id)
 
     @classmethod
+    @_locked("read")
     def search(cls, attributes: dict = {}) -> List[TypeVar('Base')]:
         """ Search all objects with matching attributes
         """
         s_class = cls.__name__
+        if STORAGE is not None:
+            return STORAGE.search(cls, attributes)
 
         def _search(obj):
             if len(attributes) == 0:
@@ -135,4 +1093,151 @@ class Base():
                     return False
             return True
 
-        return list(filter(_search, DATA[s_class].values()))
+        objs = DATA[s_class]
+        indexes = cls._indexes()
+        ids = None
+        for k, v in attributes.items():
+            if k in indexes:
+                ids = indexes[k].lookup(v)
+                if ids is not None:
+                    break
+        if isinstance(objs, LazyStore):
+            # Match stored records, only building the objects that hit
+            if ids is None:
+                ids = list(objs.keys())
+            return [objs[obj_id] for obj_id in ids
+                    if objs.matches(obj_id, attributes)]
+        if ids is not None:
+            candidates = [objs[obj_id] for obj_id in ids if obj_id in objs]
+            return list(filter(_search, candidates))
+        return list(filter(_search, objs.values()))
+
+    @classmethod
+    @_locked("read")
+    def query(cls, where: dict = {}, order_by: str = None,
+              limit: int = None, offset: int = 0) -> List[TypeVar('Base')]:
+        """ Search objects with compound predicates.
+        Each value of where is either the value the attribute must equal,
+        or a dict of operators: eq, in (a list of values), prefix, gt,
+        gte, lt and lte; timestamps may be given as strings.
+        order_by names an attribute, prefixed by "-" for descending
+        order; objects without it come last. Without order_by, objects
+        come in the order of the index or store that was scanned.
+        Candidates come from an index when one covers a predicate. When
+        the results are unordered or ordered by an indexed attribute,
+        scanning stops once offset + limit objects matched.
+        """
+        if offset < 0 or (limit is not None and limit < 0):
+            raise ValueError("Wrong limit or offset")
+        predicates = _predicates(where)
+        descending = order_by is not None and order_by.startswith('-')
+        order = order_by.lstrip('-') if order_by is not None else None
+        if STORAGE is not None:
+            return STORAGE.query(cls, predicates, order, descending,
+                                 limit, offset)
+
+        objs = DATA[cls.__name__]
+        if isinstance(objs, LazyStore):
+            # Match stored records, only building the objects returned
+            source, value = objs.records, _record_value
+        else:
+            source, value = objs, _object_value
+        end = None if limit is None else offset + limit
+
+        def _match(obj_id):
+            item = source.get(obj_id)
+            if item is None:
+                return False
+            for attribute, op, operand in predicates:
+                if not _test(value(item, attribute), op, operand):
+                    return False
+            return True
+
+        def _key(obj_id):
+            return value(source[obj_id], order)
+
+        indexes = cls._indexes()
+        ids, ordered = cls._plan(predicates, indexes, order, descending,
+                                 _key)
+        matched = filter(_match, ids)
+        if order is not None and not ordered:
+            matched = list(matched)
+            missing = [obj_id for obj_id in matched if _key(obj_id) is None]
+            present = [obj_id for obj_id in matched
+                       if _key(obj_id) is not None]
+            if end is not None and end < len(present):
+                pick = heapq.nlargest if descending else heapq.nsmallest
+                present = pick(end, present, key=_key)
+            else:
+                present.sort(key=_key, reverse=descending)
+            matched = present + missing
+        return [objs[obj_id] for obj_id in islice(matched, offset, end)]
+
+    @classmethod
+    def _plan(cls, predicates: List[tuple], indexes: dict, order: str,
+              descending: bool, key) -> tuple:
+        """ Choose how a query finds its candidate IDs.
+        Returns an iterable of IDs and whether it already follows
+        the requested order, trying in turn:
+        - the smallest eq or in lookup on an indexed attribute
+        - a walk of the index of the ordering attribute
+        - a prefix or range scan of an indexed attribute
+        - every stored ID
+        """
+        lookups = []
+        for attribute, op, operand in predicates:
+            if attribute not in indexes or op not in ('eq', 'in'):
+                continue
+            index = indexes[attribute]
+            found = [index.lookup(v) for v in
+                     (operand if op == 'in' else [operand])]
+            if None not in found:
+                lookups.append(set().union(*found))
+        if lookups:
+            return min(lookups, key=len), order is None
+
+        def _scan(attribute, reverse=False):
+            low = high = prefix = None
+            for name, op, operand in predicates:
+                if name != attribute:
+                    continue
+                operand = Index.key(operand)
+                try:
+                    if op in ('gt', 'gte'):
+                        low = operand if low is None else max(low, operand)
+                    elif op in ('lt', 'lte'):
+                        high = operand if high is None \
+                            else min(high, operand)
+                    elif op == 'prefix':
+                        prefix = operand
+                except TypeError:
+                    return None
+            return indexes[attribute].scan(low, high, prefix, reverse)
+
+        if order in indexes:
+            buckets = _scan(order, descending)
+            if buckets is not None:
+                # Keys may be coarser than values (timestamps drop
+                # microseconds): order each key's IDs by their values
+                walk = chain.from_iterable(
+                    sorted(sorted(ids), key=key, reverse=descending)
+                    if len(ids) > 1 else ids for ids in buckets)
+                missing = indexes[order].lookup(None) or set()
+                return chain(walk, sorted(missing)), True
+        for attribute, op, operand in predicates:
+            if attribute in indexes and op not in ('eq', 'in'):
+                buckets = _scan(attribute)
+                if buckets is not None:
+                    return chain.from_iterable(buckets), order is None
+        return DATA[cls.__name__].keys(), order is None
+
+
+if getenv("STORE_WRITE_BEHIND"):
+    enable_write_behind(float(getenv("STORE_FLUSH_INTERVAL", 1.0)),
+                        int(getenv("STORE_FLUSH_MAX_PENDING", 100)))
+
+
+if getenv("STORE_BACKEND") == "sqlite":
+    from models.sqlite_storage import SQLiteStorage
+    STORAGE = SQLiteStorage(getenv("STORE_SQLITE_PATH", ".db.sqlite3"),
+                            TIMESTAMP_FORMAT)
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+""" SQLite storage backend
+"""
+from contextlib import contextmanager
+from datetime import datetime
+from typing import TypeVar, List
+import json
+import sqlite3
+import threading
+
+
+# Upper bound of the strings sharing a prefix, as in models.base
+PREFIX_END = "\U0010ffff"
+# Aggregate name (and key) of the number of objects of a class
+TOTAL = ""
+
+
+class SQLiteStorage():
+    """ Storage backend keeping objects in a SQLite database,
+    shared by every process using the same file.
+    Each class gets a table holding the serialized object, plus one
+    indexed column per attribute listed in its indexed_attributes.
+    The number of objects of each class, and the counts of its
+    aggregates, are kept in _aggregates and updated by the transactions
+    that save or remove objects.
+    """
+
+    def __init__(self, file_path: str, timestamp_format: str):
+        """ Initialize the backend on a database file
+        """
+        self.file_path = file_path
+        self.timestamp_format = timestamp_format
+        self.tables = set()
+        self.tables_lock = threading.Lock()
+        self.local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        """ Return the connection of the current thread
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.file_path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS _versions "
+                "(name TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS _aggregates "
+                "(class TEXT NOT NULL, name TEXT NOT NULL, key NOT NULL, "
+                "count INTEGER NOT NULL, PRIMARY KEY (class, name, key))")
+            # Aggregates whose counters are maintained, by class
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS _aggregated "
+                "(class TEXT NOT NULL, name TEXT NOT NULL, "
+                "PRIMARY KEY (class, name))")
+            self.local.connection = connection
+        return connection
+
+    def _table(self, cls: type) -> str:
+        """ Create the table of a class if needed and return its name
+        """
+        table = cls.__name__
+        if table in self.tables:
+            return table
+        with self.tables_lock:
+            columns = "".join(', "{}"'.format(attribute)
+                              for attribute in cls.indexed_attributes)
+            connection = self._connection()
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS "{}" '
+                '(id TEXT PRIMARY KEY, data TEXT NOT NULL{})'.format(
+                    table, columns))
+            existing = {row[1] for row in connection.execute(
+                'PRAGMA table_info("{}")'.format(table))}
+            for attribute in cls.indexed_attributes:
+                if attribute in existing:
+                    continue
+                # Attribute indexed after the table was created
+                connection.execute('ALTER TABLE "{}" ADD COLUMN "{}"'.format(
+                    table, attribute))
+                connection.execute(
+                    'UPDATE "{0}" SET "{1}" = json_extract(data, ?)'.format(
+                        table, attribute),
+                    ("$.{}".format(json.dumps(attribute)),))
+            for attribute in cls.indexed_attributes:
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS "{0}_{1}" '
+                    'ON "{0}" ("{1}")'.format(table, attribute))
+            self._backfill(cls, table)
+            self.tables.add(table)
+        return table
+
+    def _backfill(self, cls: type, table: str):
+        """ Compute, once, the counters of a class that no transaction
+        maintained yet (new aggregates, or objects saved before counters)
+        """
+        with self._transaction() as connection:
+            done = {row[0] for row in connection.execute(
+                "SELECT name FROM _aggregated WHERE class = ?", (table,))}
+            for name in [TOTAL] + list(cls.aggregates):
+                if name in done:
+                    continue
+                counts = {}
+                if name == TOTAL:
+                    counts[TOTAL], = connection.execute(
+                        'SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()
+                else:
+                    attribute, key = cls.aggregates[name]
+                    for (value,) in connection.execute(
+                            'SELECT json_extract(data, ?) FROM "{}"'.format(
+                                table),
+                            ("$.{}".format(json.dumps(attribute)),)):
+                        k = key(value)
+                        if k is not None:
+                            counts[k] = counts.get(k, 0) + 1
+                connection.execute(
+                    "DELETE FROM _aggregates WHERE class = ? AND name = ?",
+                    (table, name))
+                connection.executemany(
+                    "INSERT INTO _aggregates (class, name, key, count) "
+                    "VALUES (?, ?, ?, ?)",
+                    [(table, name, k, count) for k, count in counts.items()
+                     if count > 0])
+                connection.execute(
+                    "INSERT INTO _aggregated (class, name) VALUES (?, ?)",
+                    (table, name))
+
+    def _count(self, connection: sqlite3.Connection, cls: type,
+               changes: List[tuple]):
+        """ Update the counters of a class, within a transaction, from
+        the (old, new) serialized objects it changed (None: no object)
+        """
+        deltas = {}
+        for old, new in changes:
+            for data, sign in ((old, -1), (new, 1)):
+                if data is None:
+                    continue
+                keys = [(TOTAL, TOTAL)] + [
+                    (name, key(data.get(attribute)))
+                    for name, (attribute, key) in cls.aggregates.items()]
+                for name, k in keys:
+                    if k is not None:
+                        deltas[name, k] = deltas.get((name, k), 0) + sign
+        rows = [(cls.__name__, name, k, delta)
+                for (name, k), delta in deltas.items() if delta != 0]
+        connection.executemany(
+            "INSERT INTO _aggregates (class, name, key, count) "
+            "VALUES (?, ?, ?, ?) ON CONFLICT(class, name, key) "
+            "DO UPDATE SET count = count + excluded.count", rows)
+        connection.executemany(
+            "DELETE FROM _aggregates "
+            "WHERE class = ? AND name = ? AND key = ? AND count = 0",
+            [row[:3] for row in rows])
+
+    def _value(self, value):
+        """ Convert a searched value to its stored form
+        """
+        if type(value) is datetime:
+            return value.strftime(self.timestamp_format)
+        return value
+
+    def _column(self, cls: type, attribute: str) -> tuple:
+        """ Return the SQL expression of an attribute and its parameters
+        """
+        if attribute in cls.indexed_attributes:
+            return '"{}"'.format(attribute), []
+        return "json_extract(data, ?)", ["$.{}".format(json.dumps(attribute))]
+
+    def load(self, cls: type):
+        """ Prepare the table of a class
+        """
+        self._table(cls)
+
+    def _bump(self, connection: sqlite3.Connection, cls: type):
+        """ Increment the version of a class, within a transaction
+        """
+        connection.execute(
+            "INSERT INTO _versions (name, version) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET version = version + 1",
+            (cls.__name__,))
+
+    def version(self, cls: type) -> int:
+        """ Return the version of a class, bumped by every
+        transaction that saves or removes its objects
+        """
+        row = self._connection().execute(
+            "SELECT version FROM _versions WHERE name = ?",
+            (cls.__name__,)).fetchone()
+        return row[0] if row is not None else 0
+
+    @contextmanager
+    def _transaction(self):
+        """ Run statements in a single transaction
+        """
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def save(self, obj: TypeVar('Base')):
+        """ Insert or update an object
+        """
+        self.save_many(type(obj), [obj])
+
+    def save_many(self, cls: type, objs: List[TypeVar('Base')]):
+        """ Insert or update objects of a class in one transaction
+        """
+        table = self._table(cls)
+        columns = ("id", "data") + tuple(cls.indexed_attributes)
+        rows, datas = [], []
+        for obj in objs:
+            data = obj.to_json(True)
+            datas.append(data)
+            rows.append([obj.id, json.dumps(data)] + [
+                data.get(attribute) for attribute in cls.indexed_attributes])
+        select = 'SELECT data FROM "{}" WHERE id = ?'.format(table)
+        with self._transaction() as connection:
+            # Objects as stored before, for the counters
+            changes, saved = [], {}
+            for obj, data in zip(objs, datas):
+                old = saved.get(obj.id)
+                if old is None:
+                    row = connection.execute(select, (obj.id,)).fetchone()
+                    old = json.loads(row[0]) if row is not None else None
+                changes.append((old, data))
+                saved[obj.id] = data
+            connection.executemany(
+                'INSERT INTO "{}" ({}) VALUES ({}) '
+                'ON CONFLICT(id) DO UPDATE SET {}'.format(
+                    table,
+                    ", ".join('"{}"'.format(column) for column in columns),
+                    ", ".join("?" for _ in columns),
+                    ", ".join('"{0}" = excluded."{0}"'.format(column)
+                              for column in columns[1:])),
+                rows)
+            if rows:
+                self._count(connection, cls, changes)
+                self._bump(connection, cls)
+
+    def remove(self, obj: TypeVar('Base')) -> bool:
+        """ Delete an object, return False if it wasn't stored
+        """
+        return self.remove_many(type(obj), [obj])[0]
+
+    def remove_many(self, cls: type,
+                    objs: List[TypeVar('Base')]) -> List[bool]:
+        """ Delete objects of a class in one transaction, returning
+        for each one whether it was stored
+        """
+        table = self._table(cls)
+        select = 'SELECT data FROM "{}" WHERE id = ?'.format(table)
+        delete = 'DELETE FROM "{}" WHERE id = ?'.format(table)
+        with self._transaction() as connection:
+            removed, changes = [], []
+            for obj in objs:
+                row = connection.execute(select, (obj.id,)).fetchone()
+                if row is not None:
+                    connection.execute(delete, (obj.id,))
+                    changes.append((json.loads(row[0]), None))
+                removed.append(row is not None)
+            if changes:
+                self._count(connection, cls, changes)
+                self._bump(connection, cls)
+        return removed
+
+    def count(self, cls: type) -> int:
+        """ Count the objects of a class
+        """
+        return self.aggregate(cls, TOTAL).get(TOTAL, 0)
+
+    def counts(self) -> dict:
+        """ Count the objects of every stored class, by class name
+        """
+        connection = self._connection()
+        tables = [row[0] for row in connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' "
+            "AND name NOT IN ('_versions', '_aggregates', '_aggregated')")]
+        counted = {row[0] for row in connection.execute(
+            "SELECT class FROM _aggregated WHERE name = ?", (TOTAL,))}
+        counts = {table: 0 for table in tables if table in counted}
+        counts.update(connection.execute(
+            "SELECT class, count FROM _aggregates "
+            "WHERE name = ? AND key = ?", (TOTAL, TOTAL)).fetchall())
+        for table in tables:
+            if table not in counted:
+                # Not opened by any process since counters were added
+                counts[table] = connection.execute(
+                    'SELECT COUNT(*) FROM "{}"'.format(table)).fetchone()[0]
+        return counts
+
+    def aggregate(self, cls: type, name: str) -> dict:
+        """ Return the counts of an aggregate of a class, by key
+        """
+        rows = self._connection().execute(
+            "SELECT key, count FROM _aggregates "
+            "WHERE class = ? AND name = ?", (self._table(cls), name))
+        return dict(rows.fetchall())
+
+    def get(self, cls: type, obj_id: str) -> TypeVar('Base'):
+        """ Return one object by ID, or None
+        """
+        row = self._connection().execute(
+            'SELECT data FROM "{}" WHERE id = ?'.format(self._table(cls)),
+            (obj_id,)).fetchone()
+        return cls(**json.loads(row[0])) if row is not None else None
+
+    def search(self, cls: type, attributes: dict) -> List[TypeVar('Base')]:
+        """ Return the objects whose attributes equal the given values,
+        in insertion order
+        """
+        clauses, params = [], []
+        for k, v in attributes.items():
+            column, column_params = self._column(cls, k)
+            clauses.append("{} IS ?".format(column))
+            params += column_params + [self._value(v)]
+        query = 'SELECT data FROM "{}"'.format(self._table(cls))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        rows = self._connection().execute(query + " ORDER BY rowid", params)
+        return [cls(**json.loads(row[0])) for row in rows]
+
+    def query(self, cls: type, predicates: List[tuple], order: str,
+              descending: bool, limit: int,
+              offset: int) -> List[TypeVar('Base')]:
+        """ Return the objects matching (attribute, operator, operand)
+        predicates, ordered by an attribute (missing values last) or by
+        insertion, one page at a time
+        """
+        comparisons = {'eq': "IS", 'gt': ">", 'gte': ">=",
+                       'lt': "<", 'lte': "<="}
+        clauses, params = [], []
+        for attribute, op, operand in predicates:
+            column, column_params = self._column(cls, attribute)
+            params += column_params
+            if op == 'in':
+                values = [self._value(v) for v in operand if v is not None]
+                clause = "{} IN ({})".format(
+                    column, ", ".join("?" for _ in values))
+                if None in operand:
+                    # NULL never equals anything in SQL
+                    clause = "({} OR {} IS NULL)".format(clause, column)
+                    values += column_params
+                clauses.append(clause)
+                params += values
+            elif op == 'prefix':
+                # A range rather than substr() so the index can be used
+                clauses.append("{0} >= ? AND {0} < ?".format(column))
+                params += [operand] + column_params + [operand + PREFIX_END]
+            else:
+                clauses.append("{} {} ?".format(column, comparisons[op]))
+                params.append(self._value(operand))
+        query = 'SELECT data FROM "{}"'.format(self._table(cls))
+        if clauses:
+            query += " WHERE " + " AND ".join(clauses)
+        query += " ORDER BY "
+        if order is not None:
+            column, column_params = self._column(cls, order)
+            query += "{0} IS NULL, {0}{1}, ".format(
+                column, " DESC" if descending else "")
+            params += column_params * 2
+        query += "rowid LIMIT ? OFFSET ?"
+        params += [-1 if limit is None else limit, offset]
+        rows = self._connection().execute(query, params)
+        return [cls(**json.loads(row[0])) for row in rows]
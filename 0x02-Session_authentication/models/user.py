@@ -2,13 +2,29 @@
 """ User module
 """
 import hashlib
-from models.base import Base
+from models.base import Base, timestamp_day
+
+
+def email_domain(email: str) -> str:
+    """ Return the lowercased domain of an email address, or None
+    """
+    if type(email) is not str or '@' not in email:
+        return None
+    return email.rsplit('@', 1)[1].lower()
 
 
 class User(Base):
     """ User class
     """
 
+    __slots__ = ('email', '_password', 'first_name', 'last_name')
+
+    indexed_attributes = ('email', 'created_at')
+    aggregates = {
+        'created_per_day': ('created_at', timestamp_day),
+        'per_email_domain': ('email', email_domain),
+    }
+
     def __init__(self, *args: list, **kwargs: dict):
         """ Initialize a User instance
         """
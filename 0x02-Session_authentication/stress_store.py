@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+""" Stress test of the object store under threads
+Runs writer threads (create, update, remove, snapshot) against reader
+threads (search, get, all, count) on the User store for a while, then
+checks that no thread failed, that the indexes agree with the objects
+and that reloading the files gives back the same users.
+Run it from an empty directory: it writes .db_User.* files there.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+import traceback
+from models.user import User
+
+
+def writer(stop: threading.Event, errors: list, seed: int):
+    """ Create, update and remove users until stopped
+    """
+    rng = random.Random(seed)
+    mine = []
+    try:
+        while not stop.is_set():
+            action = rng.random()
+            if action < 0.5 or not mine:
+                user = User()
+                user.email = "w{}-{}@example.com".format(seed, len(mine))
+                user.password = "pwd"
+                user.save()
+                mine.append(user)
+            elif action < 0.8:
+                user = rng.choice(mine)
+                user.first_name = "F{}".format(rng.randint(0, 9))
+                user.save()
+            elif action < 0.98:
+                mine.pop(rng.randrange(len(mine))).remove()
+            else:
+                User.save_to_file()
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def reader(stop: threading.Event, errors: list, seed: int):
+    """ Search, get, list and count users until stopped
+    """
+    rng = random.Random(seed)
+    try:
+        while not stop.is_set():
+            email = "w{}-{}@example.com".format(rng.randint(0, 3),
+                                                rng.randint(0, 50))
+            for user in User.search({'email': email}):
+                if user.email != email:
+                    raise AssertionError("index returned a wrong user")
+                User.get(user.id)
+            User.search({'first_name': "F{}".format(rng.randint(0, 9))})
+            len(User.all())
+            User.count()
+    except Exception:
+        errors.append(traceback.format_exc())
+
+
+def check() -> list:
+    """ Compare indexes and files with the objects in memory
+    """
+    problems = []
+    users = {user.id: user.email for user in User.all()}
+    for user_id, email in users.items():
+        if user_id not in [u.id for u in User.search({'email': email})]:
+            problems.append("{} missing from the email index".format(email))
+    User.save_to_file()
+    User.load_from_file()
+    reloaded = {user.id: user.email for user in User.all()}
+    if reloaded != users:
+        problems.append("reloaded users differ from the users in memory")
+    return problems
+
+
+def main():
+    """ Parse command line arguments and run the stress test
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-w", "--writers", type=int, default=4)
+    parser.add_argument("-r", "--readers", type=int, default=8)
+    parser.add_argument("-s", "--seconds", type=float, default=5.0)
+    args = parser.parse_args()
+
+    User.load_from_file()
+    stop = threading.Event()
+    errors = []
+    threads = [threading.Thread(target=writer, args=(stop, errors, i))
+               for i in range(args.writers)]
+    threads += [threading.Thread(target=reader, args=(stop, errors, i))
+                for i in range(args.readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(args.seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+
+    problems = errors + check()
+    print("{} users, {} threads, {} problems".format(
+        User.count(), len(threads), len(problems)))
+    for problem in problems:
+        print(problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
 """Python code for authentication and authorization."""
 import bcrypt
+import time
+from os import getenv
 from uuid import uuid4
 from sqlalchemy.orm.exc import NoResultFound
 from user import User
@@ -8,9 +10,46 @@ from db import DB
 from typing import Union
 
 
+DEFAULT_ROUNDS = 12
+MIN_ROUNDS = 10
+MAX_ROUNDS = 16
+_target_rounds = None
+
+
+def calibrate_rounds(target_ms: float) -> int:
+    """Return the highest bcrypt cost whose hash time fits target_ms."""
+    start = time.perf_counter()
+    bcrypt.hashpw(b"calibration", bcrypt.gensalt(MIN_ROUNDS))
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    rounds = MIN_ROUNDS
+    while rounds < MAX_ROUNDS and elapsed_ms * 2 <= target_ms:
+        elapsed_ms *= 2
+        rounds += 1
+    return rounds
+
+
+def target_rounds() -> int:
+    """Return the bcrypt cost for new hashes, calibrated once per process
+    to BCRYPT_TARGET_MS when it is set."""
+    global _target_rounds
+    if _target_rounds is None:
+        target_ms = getenv("BCRYPT_TARGET_MS")
+        if target_ms:
+            _target_rounds = calibrate_rounds(float(target_ms))
+        else:
+            _target_rounds = DEFAULT_ROUNDS
+    return _target_rounds
+
+
+def needs_rehash(hashed_password: str) -> bool:
+    """Return True if a hash was made with a cost other than the target."""
+    return int(hashed_password.split('$')[2]) != target_rounds()
+
+
 def hash_password(password: str) -> str:
     """Hash a password using bcrypt."""
-    hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt())
+    hashed = bcrypt.hashpw(password.encode('utf-8'),
+                           bcrypt.gensalt(target_rounds()))
     return hashed.decode('utf-8')
 
 
@@ -32,15 +71,22 @@ class Auth:
         return self._db.add_user(email, hashed_password)
 
     def valid_login(self, email: str, password: str) -> bool:
-        """Validate user login credentials."""
+        """Validate user login credentials.
+        A valid password whose hash was made with a different cost is
+        transparently rehashed with the target cost."""
         try:
             user = self._db.find_user_by(email=email)
-            return bcrypt.checkpw(
+        except NoResultFound:
+            return False
+        if not bcrypt.checkpw(
                 password.encode('utf-8'),
                 user.hashed_password.encode('utf-8')
-                )
-        except NoResultFound:
+                ):
             return False
+        if needs_rehash(user.hashed_password):
+            self._db.update_user(user.id,
+                                 hashed_password=hash_password(password))
+        return True
 
     def create_session(self, email: str) -> Union[str, None]:
         """Return a session ID for a user."""